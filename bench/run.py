@@ -0,0 +1,146 @@
+"""
+Benchmark `Extractor` on a synthetic repo, `Result.metrics` of each run are printed as json.
+
+the installed package is benchmarked, install the checkout first:
+
+pip install -e .
+python bench/run.py --files 1000 --commits 5000 --output bench.json
+
+runs:
+- cold: no cache
+- warm: everything cached
+- incremental: after some new commits
+"""
+import json
+import pathlib
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from synthetic_repo import generate, gen_message  # noqa: E402
+
+try:
+    from git_file_keyword import __VERSION__
+except ImportError:
+    sys.exit("git_file_keyword is not installed, run `pip install -e .` first")
+from git_file_keyword.config import ExtractConfig, FileLevelEnum  # noqa: E402
+from git_file_keyword.extractor import Extractor  # noqa: E402
+from git_file_keyword.result import export_csv  # noqa: E402
+
+
+def run_once(config: ExtractConfig, output_dir: pathlib.Path, name: str) -> dict:
+    start = time.perf_counter()
+    extractor = Extractor(config.model_copy())
+    result = extractor.extract()
+    extract_seconds = time.perf_counter() - start
+
+    with result.metrics.timer("export"):
+        export_csv(result.file_results.values(), str(output_dir / f"{name}.csv"))
+
+    return {
+        "name": name,
+        "extract_seconds": round(extract_seconds, 4),
+        "files": len(result.file_results),
+        "renewed": sum(not each.cached for each in result.file_results.values()),
+        **result.metrics.report(),
+    }
+
+
+def add_commits(repo: pathlib.Path, commits: int, lang: str, seed: int):
+    rnd = random.Random(seed)
+    tracked = subprocess.check_output(["git", "ls-files"], cwd=repo, text=True).split()
+    for i in range(commits):
+        each = rnd.choice(tracked)
+        with open(repo / each, "a", encoding="utf-8") as f:
+            f.write(f"# new {i}\n")
+        subprocess.check_call(
+            [
+                "git", "-c", "user.name=bench", "-c", "user.email=bench@example.com",
+                "commit", "-q", "-am", gen_message(rnd, lang),
+            ],
+            cwd=repo,
+        )
+
+
+@click.command()
+@click.option("--files", default=200)
+@click.option("--commits", default=1000)
+@click.option("--files_per_commit", default=3)
+@click.option("--lang", default="en", type=click.Choice(["en", "zh", "mixed"]))
+@click.option("--new_commits", default=10, help="commits added before the incremental run")
+@click.option("--file_level", default="FILE", type=click.Choice(["FILE", "DIR"]))
+@click.option("--jobs", default=1)
+@click.option("--seed", default=42)
+@click.option("--repo", default="", help="existing repo to clone, instead of generating one")
+@click.option("--output", default="", help="json file, stdout if empty")
+def main(
+        files: int,
+        commits: int,
+        files_per_commit: int,
+        lang: str,
+        new_commits: int,
+        file_level: str,
+        jobs: int,
+        seed: int,
+        repo: str,
+        output: str,
+):
+    with tempfile.TemporaryDirectory(prefix="gfk_bench_") as tmp:
+        tmp = pathlib.Path(tmp)
+        start = time.perf_counter()
+        if repo:
+            # never touch the cache of the origin repo
+            repo_path = tmp / "repo"
+            subprocess.check_call(["git", "clone", "-q", str(pathlib.Path(repo).resolve()), str(repo_path)])
+        else:
+            repo_path = generate(tmp / "repo", files, commits, files_per_commit, lang, seed)
+        generate_seconds = time.perf_counter() - start
+
+        config = ExtractConfig(
+            repo_root=repo_path,
+            file_level=FileLevelEnum(file_level),
+            workers=jobs,
+            incremental=True,
+        )
+        runs = []
+        config.cache_enabled = False
+        runs.append(run_once(config, tmp, "cold"))
+        config.cache_enabled = True
+        runs.append(run_once(config, tmp, "warm"))
+        if new_commits:
+            add_commits(repo_path, new_commits, lang, seed)
+            runs.append(run_once(config, tmp, "incremental"))
+
+    report = {
+        "version": __VERSION__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "files": files,
+            "commits": commits,
+            "files_per_commit": files_per_commit,
+            "lang": lang,
+            "new_commits": new_commits,
+            "file_level": file_level,
+            "jobs": jobs,
+            "seed": seed,
+            "repo": repo,
+        },
+        "generate_seconds": round(generate_seconds, 4),
+        "runs": runs,
+    }
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        pathlib.Path(output).write_text(data, encoding="utf-8")
+    else:
+        click.echo(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Generate a synthetic git repo offline, for benchmark.
+
+python bench/synthetic_repo.py ./syn_repo --files 1000 --commits 5000 --files_per_commit 3 --lang mixed
+"""
+import os
+import pathlib
+import random
+import subprocess
+import typing
+
+import click
+
+WORDS_EN = (
+    "parser lexer cache network socket render widget token stream buffer "
+    "config schema request response client server router handler session "
+    "auth login logout upload download retry timeout queue worker thread "
+    "memory leak crash fix refactor feature test docs build release"
+).split()
+WORDS_ZH = (
+    "解析 缓存 网络 配置 渲染 组件 请求 响应 客户端 服务端 路由 会话 "
+    "登录 上传 下载 重试 超时 队列 线程 内存 泄漏 崩溃 修复 重构 功能 测试 文档 发布"
+).split()
+VERBS_EN = "fix add update remove refactor improve support".split()
+VERBS_ZH = "修复 新增 更新 删除 重构 优化 支持".split()
+
+
+def gen_message(rnd: random.Random, lang: str) -> str:
+    if lang == "mixed":
+        lang = rnd.choice(("en", "zh"))
+    if lang == "zh":
+        return rnd.choice(VERBS_ZH) + "".join(rnd.sample(WORDS_ZH, 3))
+    return f"{rnd.choice(VERBS_EN)} {' '.join(rnd.sample(WORDS_EN, 4))}"
+
+
+def gen_file_paths(rnd: random.Random, files: int, max_depth: int = 3) -> typing.List[str]:
+    ret = []
+    for i in range(files):
+        depth = rnd.randint(0, max_depth)
+        parts = [f"{rnd.choice(WORDS_EN)}{rnd.randint(0, 3)}" for _ in range(depth)]
+        ret.append("/".join(parts + [f"file{i}.py"]))
+    return ret
+
+
+def generate(
+        path: pathlib.Path,
+        files: int = 200,
+        commits: int = 1000,
+        files_per_commit: int = 3,
+        lang: str = "en",
+        seed: int = 42,
+) -> pathlib.Path:
+    """ all the commits are written with one `git fast-import`, so it takes seconds only """
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    subprocess.check_call(["git", "init", "-q"], cwd=path)
+
+    rnd = random.Random(seed)
+    file_paths = gen_file_paths(rnd, files)
+    contents: typing.Dict[str, str] = dict()
+
+    lines = []
+    timestamp = 1_600_000_000
+    for i in range(commits):
+        # every file exists since the first commit
+        touched = file_paths if i == 0 else rnd.sample(file_paths, min(files_per_commit, files))
+        message = gen_message(rnd, lang).encode("utf-8")
+        lines.append("commit refs/heads/master")
+        lines.append(f"committer bench <bench@example.com> {timestamp + i * 60} +0000")
+        lines.append(f"data {len(message)}")
+        # commits of the same branch are chained by fast-import
+        lines.append(message.decode("utf-8"))
+        for each in touched:
+            contents[each] = contents.get(each, "") + f"# {i}\n"
+            data = contents[each].encode("utf-8")
+            lines.append(f"M 100644 inline {each}")
+            lines.append(f"data {len(data)}")
+            lines.append(contents[each])
+    stream = ("\n".join(lines) + "\n").encode("utf-8")
+
+    subprocess.run(
+        ["git", "fast-import", "--quiet"], cwd=path, input=stream, check=True
+    )
+    subprocess.check_call(["git", "checkout", "-q", "-f", "master"], cwd=path)
+    return path
+
+
+@click.command()
+@click.argument("path")
+@click.option("--files", default=200)
+@click.option("--commits", default=1000)
+@click.option("--files_per_commit", default=3)
+@click.option("--lang", default="en", type=click.Choice(["en", "zh", "mixed"]))
+@click.option("--seed", default=42)
+def main(path: str, files: int, commits: int, files_per_commit: int, lang: str, seed: int):
+    if os.path.exists(os.path.join(path, ".git")):
+        raise click.ClickException(f"{path} is already a git repo")
+    generate(pathlib.Path(path), files, commits, files_per_commit, lang, seed)
+    click.echo(f"generated: {path}")
+
+
+if __name__ == "__main__":
+    main()
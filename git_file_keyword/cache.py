@@ -0,0 +1,673 @@
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import tempfile
+import typing
+from collections import defaultdict
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:
+    # windows, writes are still atomic but not locked
+    fcntl = None
+
+from git_file_keyword.config import ExtractConfig, CacheBackendEnum
+from git_file_keyword.plugin import TFIDF_PLUGIN_ID
+from git_file_keyword.result import FileResult, CommitResult, KeywordHit
+from git_file_keyword.utils import split_list
+
+
+def keyword_terms(file_result: FileResult) -> typing.Dict[str, typing.Tuple[float, int]]:
+    # word -> (tf-idf score, freq)
+    # words in word_freq are searchable too, but ranked after the keywords
+    scores = file_result.plugin_output.get(TFIDF_PLUGIN_ID) or dict()
+    ret = dict()
+    for word in set(file_result.word_freq).union(file_result.keywords):
+        ret[word] = (float(scores.get(word, 0.0)), file_result.word_freq.get(word, 0))
+    return ret
+
+
+def rank_hits(hits: typing.Dict[str, KeywordHit], limit: int) -> typing.List[KeywordHit]:
+    return sorted(hits.values(), key=lambda x: (-x.score, -x.freq, x.path))[:limit]
+
+
+# how `CommitResult.model_dump_json()` starts
+_COMMIT_LINE_PREFIX = '{"sha":"'
+
+
+def read_description_file(path: pathlib.Path) -> typing.Dict[str, str]:
+    # llm.txt, one json line for each description, the last one wins
+    ret = dict()
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                each = json.loads(line)
+                ret[each["key"]] = each["description"]
+    return ret
+
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path, shared: bool = False):
+    # advisory lock on a separate file, data files are replaced instead of rewritten
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path: pathlib.Path, lines: typing.Iterable[str]):
+    # readers always see a complete file, the old one or the new one
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + os.linesep)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class BaseCacheBackend(object):
+    # several runs may write to the same cache at the same time
+    # state derived from all the rows (like tf-idf df) can not be kept in it
+    concurrent = False
+
+    def __init__(self, cache_dir: pathlib.Path):
+        self.cache_dir = cache_dir
+
+    def load(self) -> typing.Dict[pathlib.Path, FileResult]:
+        raise NotImplementedError
+
+    def get(self, path: str) -> typing.Optional[FileResult]:
+        raise NotImplementedError
+
+    # upsert
+    def write(self, file_results: typing.Iterable[FileResult]):
+        raise NotImplementedError
+
+    # only the given commits, a run usually needs a few of them
+    def read_commit_tokens(
+            self, fingerprint: str, shas: typing.Iterable[str]
+    ) -> typing.Dict[str, typing.Set[str]]:
+        raise NotImplementedError
+
+    def write_commit_tokens(
+            self, fingerprint: str, commit_tokens: typing.Dict[str, typing.Set[str]]
+    ):
+        raise NotImplementedError
+
+    # commit sha -> [old path, new path] of its renames, see `CommitIndex`
+    def read_commit_renames(self) -> typing.Dict[str, typing.List[typing.List[str]]]:
+        raise NotImplementedError
+
+    def write_commit_renames(self, commit_renames: typing.Dict[str, typing.List[typing.List[str]]]):
+        raise NotImplementedError
+
+    # llm description key -> description, see `BaseLLMPlugin.description_key`
+    def read_descriptions(self, keys: typing.Iterable[str]) -> typing.Dict[str, str]:
+        raise NotImplementedError
+
+    def write_descriptions(self, descriptions: typing.Dict[str, str]):
+        raise NotImplementedError
+
+    # files containing any of the words, best first
+    def query_keyword(self, words: typing.Iterable[str], limit: int = 20) -> typing.List[KeywordHit]:
+        raise NotImplementedError
+
+    def read_meta(self, key: str) -> typing.Optional[str]:
+        raise NotImplementedError
+
+    def write_meta(self, key: str, value: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def dump_file_result(file_result: FileResult) -> str:
+        # `cached` only makes sense in current run
+        # not exclude_unset: plugins update `plugin_output` in place
+        return file_result.model_dump_json(exclude_defaults=True, exclude={"cached"})
+
+
+class JsonlCacheBackend(BaseCacheBackend):
+    """ the original format: one json line for each file in word.txt """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file_results: typing.Optional[typing.Dict[str, FileResult]] = None
+
+    def get_word_file(self) -> pathlib.Path:
+        return self.cache_dir / "word.txt"
+
+    def get_commit_file(self) -> pathlib.Path:
+        return self.cache_dir / "commit.txt"
+
+    def get_meta_file(self) -> pathlib.Path:
+        return self.cache_dir / "meta.json"
+
+    def get_rename_file(self) -> pathlib.Path:
+        return self.cache_dir / "rename.txt"
+
+    def get_description_file(self) -> pathlib.Path:
+        return self.cache_dir / "llm.txt"
+
+    def _read_all(self) -> typing.Dict[str, FileResult]:
+        if self._file_results is not None:
+            return self._file_results
+
+        self._file_results = dict()
+        word = self.get_word_file()
+        if word.exists():
+            with open(word, "r", encoding="utf-8") as f:
+                for line in f:
+                    file_result = FileResult.model_validate_json(line.strip())
+                    self._file_results[file_result.path] = file_result
+        return self._file_results
+
+    def load(self) -> typing.Dict[pathlib.Path, FileResult]:
+        return {
+            pathlib.Path(path): file_result
+            for path, file_result in self._read_all().items()
+        }
+
+    def get(self, path: str) -> typing.Optional[FileResult]:
+        return self._read_all().get(path)
+
+    def write(self, file_results: typing.Iterable[FileResult]):
+        file_result_dict = self._read_all()
+        for each in file_results:
+            file_result_dict[each.path] = each
+
+        # jsonl can not be updated in place
+        with open(self.get_word_file(), "w+", encoding="utf-8") as f:
+            for file_result in file_result_dict.values():
+                f.write(self.dump_file_result(file_result) + os.linesep)
+
+    def read_commit_tokens(
+            self, fingerprint: str, shas: typing.Iterable[str]
+    ) -> typing.Dict[str, typing.Set[str]]:
+        commit_file = self.get_commit_file()
+        shas = set(shas)
+        if not commit_file.exists() or not shas:
+            return dict()
+
+        ret = dict()
+        with open(commit_file, "r", encoding="utf-8") as f:
+            for line in f:
+                # {"sha":"<sha>",...}, skip other commits without decoding
+                if line.startswith(_COMMIT_LINE_PREFIX):
+                    sha = line[len(_COMMIT_LINE_PREFIX):line.find('"', len(_COMMIT_LINE_PREFIX))]
+                    if sha not in shas:
+                        continue
+                commit_result = CommitResult.model_validate_json(line.strip())
+                if commit_result.fingerprint == fingerprint and commit_result.sha in shas:
+                    ret[commit_result.sha] = set(commit_result.tokens)
+        return ret
+
+    def write_commit_tokens(
+            self, fingerprint: str, commit_tokens: typing.Dict[str, typing.Set[str]]
+    ):
+        # commits never change, append only
+        with open(self.get_commit_file(), "a", encoding="utf-8") as f:
+            for sha, tokens in commit_tokens.items():
+                commit_result = CommitResult(
+                    sha=sha, fingerprint=fingerprint, tokens=sorted(tokens)
+                )
+                f.write(commit_result.model_dump_json() + os.linesep)
+
+    def read_commit_renames(self) -> typing.Dict[str, typing.List[typing.List[str]]]:
+        rename_file = self.get_rename_file()
+        if not rename_file.exists():
+            return dict()
+
+        ret = dict()
+        with open(rename_file, "r", encoding="utf-8") as f:
+            for line in f:
+                each = json.loads(line)
+                ret[each["sha"]] = each["renames"]
+        return ret
+
+    def write_commit_renames(self, commit_renames: typing.Dict[str, typing.List[typing.List[str]]]):
+        # commits never change, append only
+        with open(self.get_rename_file(), "a", encoding="utf-8") as f:
+            for sha, renames in commit_renames.items():
+                line = json.dumps({"sha": sha, "renames": renames}, ensure_ascii=False)
+                f.write(line + os.linesep)
+
+    def _read_description_dict(self) -> typing.Dict[str, str]:
+        return read_description_file(self.get_description_file())
+
+    def read_descriptions(self, keys: typing.Iterable[str]) -> typing.Dict[str, str]:
+        descriptions = self._read_description_dict()
+        return {each: descriptions[each] for each in keys if each in descriptions}
+
+    def write_descriptions(self, descriptions: typing.Dict[str, str]):
+        # rewritten, a key appears only once
+        merged = self._read_description_dict()
+        merged.update(descriptions)
+        atomic_write(
+            self.get_description_file(),
+            (
+                json.dumps({"key": key, "description": description}, ensure_ascii=False)
+                for key, description in merged.items()
+            ),
+        )
+
+    def query_keyword(self, words: typing.Iterable[str], limit: int = 20) -> typing.List[KeywordHit]:
+        # no index in jsonl, scan all the files
+        words = set(words)
+        hits: typing.Dict[str, KeywordHit] = dict()
+        for path, file_result in self._read_all().items():
+            terms = keyword_terms(file_result)
+            for word in words.intersection(terms):
+                score, freq = terms[word]
+                hit = hits.setdefault(path, KeywordHit(path=path))
+                hit.score += score
+                hit.freq += freq
+        return rank_hits(hits, limit)
+
+    def _read_meta_dict(self) -> typing.Dict[str, str]:
+        meta_file = self.get_meta_file()
+        if not meta_file.exists():
+            return dict()
+        with open(meta_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read_meta(self, key: str) -> typing.Optional[str]:
+        return self._read_meta_dict().get(key)
+
+    def write_meta(self, key: str, value: str):
+        meta = self._read_meta_dict()
+        meta[key] = value
+        with open(self.get_meta_file(), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+
+class ShardedJsonlCacheBackend(JsonlCacheBackend):
+    """
+    word.txt split into shards by the hash of path.
+    a write rewrites only the shards it touched, each one under its own lock,
+    so runs on different subtrees can share the cache dir.
+
+    rows are merged under the lock: a row which was not extracted again in this run
+    (only rescored) never replaces a newer one written by another run.
+    """
+
+    concurrent = True
+
+    def __init__(self, cache_dir: pathlib.Path, shards: int = 64):
+        super().__init__(cache_dir)
+        self.shards = shards
+        # path -> `_source_of` the row when it was read
+        self._sources: typing.Dict[str, str] = dict()
+
+    @staticmethod
+    def _source_of(file_result: FileResult) -> str:
+        # what the row is extracted from, keywords are derived from it
+        return file_result.model_dump_json(include={"checksum", "fingerprint", "word_freq"})
+
+    def get_shard_dir(self) -> pathlib.Path:
+        # shard count is a part of the layout, changing it starts a new cache
+        ret = self.cache_dir / f"word_{self.shards}"
+        ret.mkdir(exist_ok=True)
+        return ret
+
+    def get_shard_file(self, shard: int) -> pathlib.Path:
+        return self.get_shard_dir() / f"{shard}.txt"
+
+    def get_lock_file(self, name: str) -> pathlib.Path:
+        return self.cache_dir / f"{name}.lock"
+
+    def shard_of(self, path: str) -> int:
+        digest = hashlib.blake2b(path.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.shards
+
+    def _read_shard(self, shard: int) -> typing.Dict[str, FileResult]:
+        ret = dict()
+        shard_file = self.get_shard_file(shard)
+        if shard_file.exists():
+            with open(shard_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    file_result = FileResult.model_validate_json(line.strip())
+                    ret[file_result.path] = file_result
+        return ret
+
+    def _read_all(self) -> typing.Dict[str, FileResult]:
+        if self._file_results is not None:
+            return self._file_results
+
+        self._file_results = dict()
+        for shard in range(self.shards):
+            self._file_results.update(self._read_shard(shard))
+        self._sources = {
+            path: self._source_of(each) for path, each in self._file_results.items()
+        }
+        return self._file_results
+
+    def get(self, path: str) -> typing.Optional[FileResult]:
+        if self._file_results is not None:
+            return self._file_results.get(path)
+        return self._read_shard(self.shard_of(path)).get(path)
+
+    def write(self, file_results: typing.Iterable[FileResult]):
+        shard_dict: typing.Dict[int, typing.List[FileResult]] = defaultdict(list)
+        for each in file_results:
+            shard_dict[self.shard_of(each.path)].append(each)
+
+        kept = 0
+        for shard, shard_results in shard_dict.items():
+            with file_lock(self.get_shard_dir() / f"{shard}.lock"):
+                # merge with the rows written by other runs since we read it
+                file_result_dict = self._read_shard(shard)
+                for each in shard_results:
+                    source = self._source_of(each)
+                    on_disk = file_result_dict.get(each.path)
+                    if (
+                            on_disk is not None
+                            and source == self._sources.get(each.path)
+                            and self._source_of(on_disk) != source
+                    ):
+                        # only rescored here, but extracted again by another run
+                        kept += 1
+                        continue
+                    file_result_dict[each.path] = each
+                    self._sources[each.path] = source
+                atomic_write(
+                    self.get_shard_file(shard),
+                    (self.dump_file_result(each) for each in file_result_dict.values()),
+                )
+            if self._file_results is not None:
+                self._file_results.update(file_result_dict)
+        logger.debug(f"{len(shard_dict)} of {self.shards} shards rewritten, {kept} newer rows kept")
+
+    def read_commit_tokens(
+            self, fingerprint: str, shas: typing.Iterable[str]
+    ) -> typing.Dict[str, typing.Set[str]]:
+        # the last line may be half written without the lock
+        with file_lock(self.get_lock_file("commit"), shared=True):
+            return super().read_commit_tokens(fingerprint, shas)
+
+    def write_commit_tokens(
+            self, fingerprint: str, commit_tokens: typing.Dict[str, typing.Set[str]]
+    ):
+        with file_lock(self.get_lock_file("commit")):
+            super().write_commit_tokens(fingerprint, commit_tokens)
+
+    def read_commit_renames(self) -> typing.Dict[str, typing.List[typing.List[str]]]:
+        with file_lock(self.get_lock_file("rename"), shared=True):
+            return super().read_commit_renames()
+
+    def write_commit_renames(self, commit_renames: typing.Dict[str, typing.List[typing.List[str]]]):
+        with file_lock(self.get_lock_file("rename")):
+            super().write_commit_renames(commit_renames)
+
+    def read_descriptions(self, keys: typing.Iterable[str]) -> typing.Dict[str, str]:
+        with file_lock(self.get_lock_file("llm"), shared=True):
+            return super().read_descriptions(keys)
+
+    def write_descriptions(self, descriptions: typing.Dict[str, str]):
+        with file_lock(self.get_lock_file("llm")):
+            super().write_descriptions(descriptions)
+
+    def write_meta(self, key: str, value: str):
+        with file_lock(self.get_lock_file("meta")):
+            meta = self._read_meta_dict()
+            meta[key] = value
+            atomic_write(self.get_meta_file(), [json.dumps(meta, ensure_ascii=False)])
+
+
+class SqliteCacheBackend(BaseCacheBackend):
+    """
+    indexed by path, rows can be updated one by one.
+    `keyword_index` (word -> files) is updated along with the changed rows.
+    """
+
+    # bump it when existing tables change, old cache will be dropped
+    SCHEMA_VERSION = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._conn: typing.Optional[sqlite3.Connection] = None
+
+    def get_db_file(self) -> pathlib.Path:
+        return self.cache_dir / "cache.db"
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # connect lazily, nothing will be touched if no one asks
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.get_db_file(), check_same_thread=False)
+            self._init_schema()
+        return self._conn
+
+    def _init_schema(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version and version != self.SCHEMA_VERSION:
+            logger.warning(f"cache schema changed: {version} -> {self.SCHEMA_VERSION}, drop it")
+            with self._conn:
+                self._conn.executescript(
+                    """
+                    DROP TABLE IF EXISTS file_result;
+                    DROP TABLE IF EXISTS commit_token;
+                    DROP TABLE IF EXISTS meta;
+                    DROP TABLE IF EXISTS keyword_index;
+                    DROP TABLE IF EXISTS commit_rename;
+                    DROP TABLE IF EXISTS llm_description;
+                    """
+                )
+
+        # tables added later should be filled from the existing rows
+        keyword_index_exists = self._table_exists("keyword_index")
+        llm_description_exists = self._table_exists("llm_description")
+
+        # new tables can be added here without a version bump
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS file_result (
+                    path TEXT PRIMARY KEY,
+                    checksum TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS commit_token (
+                    fingerprint TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    tokens TEXT NOT NULL,
+                    PRIMARY KEY (fingerprint, sha)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS commit_rename (
+                    sha TEXT PRIMARY KEY,
+                    renames TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS llm_description (
+                    key TEXT PRIMARY KEY,
+                    description TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS keyword_index (
+                    word TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    freq INTEGER NOT NULL,
+                    PRIMARY KEY (word, path)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS keyword_index_path ON keyword_index (path);
+                """
+            )
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        if not keyword_index_exists:
+            file_results = list(self.load().values())
+            if file_results:
+                logger.info(f"build keyword index for {len(file_results)} cached files")
+                with self._conn:
+                    self._write_keyword_index(file_results)
+
+        # descriptions were always kept in llm.txt before, they took some money
+        legacy_file = self.cache_dir / "llm.txt"
+        if not llm_description_exists and legacy_file.exists():
+            descriptions = read_description_file(legacy_file)
+            logger.info(f"import {len(descriptions)} llm descriptions from {legacy_file}")
+            self.write_descriptions(descriptions)
+
+    def _table_exists(self, name: str) -> bool:
+        return bool(self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone())
+
+    def load(self) -> typing.Dict[pathlib.Path, FileResult]:
+        ret = dict()
+        for path, data in self.conn.execute("SELECT path, data FROM file_result"):
+            ret[pathlib.Path(path)] = FileResult.model_validate_json(data)
+        return ret
+
+    def get(self, path: str) -> typing.Optional[FileResult]:
+        row = self.conn.execute(
+            "SELECT data FROM file_result WHERE path = ?", (path,)
+        ).fetchone()
+        if not row:
+            return None
+        return FileResult.model_validate_json(row[0])
+
+    def write(self, file_results: typing.Iterable[FileResult]):
+        file_results = list(file_results)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO file_result (path, checksum, data) VALUES (?, ?, ?)",
+                (
+                    (each.path, each.checksum, self.dump_file_result(each))
+                    for each in file_results
+                ),
+            )
+            self._write_keyword_index(file_results)
+
+    def _write_keyword_index(self, file_results: typing.List[FileResult]):
+        # replace all the words of these files
+        self.conn.executemany(
+            "DELETE FROM keyword_index WHERE path = ?",
+            ((each.path,) for each in file_results),
+        )
+        self.conn.executemany(
+            "INSERT INTO keyword_index (word, path, score, freq) VALUES (?, ?, ?, ?)",
+            (
+                (word, each.path, score, freq)
+                for each in file_results
+                for word, (score, freq) in keyword_terms(each).items()
+            ),
+        )
+
+    def query_keyword(self, words: typing.Iterable[str], limit: int = 20) -> typing.List[KeywordHit]:
+        words = list(set(words))
+        if not words:
+            return []
+        rows = self.conn.execute(
+            f"""
+            SELECT path, SUM(score), SUM(freq) FROM keyword_index
+            WHERE word IN ({",".join("?" * len(words))})
+            GROUP BY path
+            ORDER BY SUM(score) DESC, SUM(freq) DESC, path
+            LIMIT ?
+            """,
+            words + [limit],
+        )
+        return [KeywordHit(path=path, score=score, freq=freq) for path, score, freq in rows]
+
+    def read_commit_tokens(
+            self, fingerprint: str, shas: typing.Iterable[str]
+    ) -> typing.Dict[str, typing.Set[str]]:
+        ret = dict()
+        # sqlite limits the variables of a statement
+        for each_batch in split_list(list(set(shas)), 500):
+            rows = self.conn.execute(
+                f"SELECT sha, tokens FROM commit_token "
+                f"WHERE fingerprint = ? AND sha IN ({','.join('?' * len(each_batch))})",
+                [fingerprint] + each_batch,
+            )
+            ret.update((sha, set(json.loads(tokens))) for sha, tokens in rows)
+        return ret
+
+    def write_commit_tokens(
+            self, fingerprint: str, commit_tokens: typing.Dict[str, typing.Set[str]]
+    ):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO commit_token (fingerprint, sha, tokens) VALUES (?, ?, ?)",
+                (
+                    (fingerprint, sha, json.dumps(sorted(tokens), ensure_ascii=False))
+                    for sha, tokens in commit_tokens.items()
+                ),
+            )
+
+    def read_commit_renames(self) -> typing.Dict[str, typing.List[typing.List[str]]]:
+        rows = self.conn.execute("SELECT sha, renames FROM commit_rename")
+        return {sha: json.loads(renames) for sha, renames in rows}
+
+    def write_commit_renames(self, commit_renames: typing.Dict[str, typing.List[typing.List[str]]]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO commit_rename (sha, renames) VALUES (?, ?)",
+                (
+                    (sha, json.dumps(renames, ensure_ascii=False))
+                    for sha, renames in commit_renames.items()
+                ),
+            )
+
+    def read_descriptions(self, keys: typing.Iterable[str]) -> typing.Dict[str, str]:
+        ret = dict()
+        keys = list(set(keys))
+        # sqlite limits the variables of a statement
+        for each_batch in split_list(keys, 500):
+            rows = self.conn.execute(
+                f"SELECT key, description FROM llm_description "
+                f"WHERE key IN ({','.join('?' * len(each_batch))})",
+                each_batch,
+            )
+            ret.update(rows)
+        return ret
+
+    def write_descriptions(self, descriptions: typing.Dict[str, str]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO llm_description (key, description) VALUES (?, ?)",
+                descriptions.items(),
+            )
+
+    def read_meta(self, key: str) -> typing.Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    def write_meta(self, key: str, value: str):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def create_cache_backend(config: ExtractConfig) -> BaseCacheBackend:
+    cache_dir = config.get_cache_dir()
+    if config.cache_backend == CacheBackendEnum.JSONL:
+        return JsonlCacheBackend(cache_dir)
+    if config.cache_backend == CacheBackendEnum.SHARDED:
+        return ShardedJsonlCacheBackend(cache_dir, config.cache_shards)
+    return SqliteCacheBackend(cache_dir)
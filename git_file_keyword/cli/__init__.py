@@ -1,59 +1,236 @@
-import glob
-import os
 import pathlib
+import time
+import typing
 
 import click
-from git_file_keyword.config import FileLevelEnum
+from git_file_keyword.config import FileLevelEnum, CacheBackendEnum
 
 from git_file_keyword.extractor import Extractor
-from git_file_keyword.plugin_llm import OpenAILLMPlugin
+from git_file_keyword.result import export_csv
 
 
-@click.command()
+# --file_level dir works too
+FILE_LEVEL_CHOICE = click.Choice([each.value for each in FileLevelEnum], case_sensitive=False)
+
+
+def create_extractor(repo: str, stopword_txt: str, file_level: str, jobs: int) -> Extractor:
+    extractor = Extractor()
+    extractor.config.repo_root = pathlib.Path(repo).resolve().absolute()
+    extractor.config.file_level = FileLevelEnum(file_level) if file_level else FileLevelEnum.FILE
+    extractor.config.workers = jobs
+
+    if stopword_txt:
+        stopword_txt_list = stopword_txt.split(",")
+        for each in stopword_txt_list:
+            extractor.add_stopwords_file(each)
+    return extractor
+
+
+@click.group(invoke_without_command=True)
 @click.option("--repo", default=".")
 @click.option("--output_csv", default="./output.csv")
 @click.option("--include", default="**")
 @click.option("--stopword_txt", default="")
 @click.option("--openai_key", default="")
-@click.option("--llm_rate_limit_wait", default="")
+@click.option("--llm_api_base", default="", help="openai-compatible api, local server if no key")
+@click.option("--llm_model", default="")
+@click.option("--llm_rate_limit_wait", default=0.0, help="seconds between llm requests, legacy")
+@click.option("--llm_rpm", default=0.0, help="llm requests per minute")
+@click.option("--llm_tpm", default=0.0, help="llm tokens per minute")
+@click.option("--llm_concurrency", type=int, help="llm requests in flight, 4 for openai and 8 for local")
+@click.option("--llm_max_tokens", default=1500, help="keyword tokens packed into each llm request")
 @click.option("--cache_enabled", default=True)
-@click.option("--file_level")
+@click.option("--cache_backend", default="SQLITE", type=click.Choice([each.value for each in CacheBackendEnum]))
+@click.option("--file_level", type=FILE_LEVEL_CHOICE)
+@click.option("--jobs", default=1, help="worker processes for keyword extraction")
+@click.option("--incremental", is_flag=True, help="only update files touched since last run")
+@click.option("--follow_renames", is_flag=True, help="history of moved files includes the commits before moving")
+@click.option("--profile", is_flag=True, help="print time and counters of each stage")
+@click.option("--metrics_output", default="", help="save metrics to file, prometheus text if *.prom else json")
+@click.pass_context
 def main(
+        ctx: click.Context,
         repo: str,
         output_csv: str,
         include: str,
         stopword_txt: str,
         openai_key: str,
-        llm_rate_limit_wait: int,
+        llm_api_base: str,
+        llm_model: str,
+        llm_rate_limit_wait: float,
+        llm_rpm: float,
+        llm_tpm: float,
+        llm_concurrency: int,
+        llm_max_tokens: int,
         cache_enabled: bool,
+        cache_backend: str,
         file_level: str,
+        jobs: int,
+        incremental: bool,
+        follow_renames: bool,
+        profile: bool,
+        metrics_output: str,
 ):
     # gfk --include "**/*.py" --openai_key="sk-***"
-    extractor = Extractor()
-
-    repo = pathlib.Path(repo).resolve().absolute()
-    extractor.config.repo_root = repo
+    if ctx.invoked_subcommand is not None:
+        # e.g. gfk serve
+        # options of the main command are not for subcommands
+        given = [
+            each for each in ctx.params
+            if ctx.get_parameter_source(each) != click.core.ParameterSource.DEFAULT
+        ]
+        if given:
+            raise click.UsageError(
+                f"options should follow the subcommand: "
+                f"gfk {ctx.invoked_subcommand} {' '.join('--' + each for each in given)} ..."
+            )
+        return
 
-    file_paths = glob.glob(os.path.join(repo.as_posix(), include), recursive=True)
-    extractor.config.file_list = file_paths
+    extractor = create_extractor(repo, stopword_txt, file_level, jobs)
+    # matched against git index, untracked dirs like node_modules are never walked
+    extractor.config.include = include
     extractor.config.cache_enabled = cache_enabled
-    extractor.config.file_level = file_level or FileLevelEnum.FILE
+    extractor.config.cache_backend = CacheBackendEnum(cache_backend)
+    extractor.config.incremental = incremental
+    extractor.config.follow_renames = follow_renames
 
-    if stopword_txt:
-        stopword_txt_list = stopword_txt.split(",")
-        for each in stopword_txt_list:
-            extractor.add_stopwords_file(each)
-
-    if openai_key:
+    if openai_key or llm_api_base:
         # enable llm enhancement
-        openai_plugin = OpenAILLMPlugin()
-        openai_plugin.token = openai_key
+        # without a key, the api is a local server
+        from git_file_keyword.plugin_llm import OpenAILLMPlugin, LocalLLMPlugin
+
+        if openai_key:
+            openai_plugin = OpenAILLMPlugin()
+            openai_plugin.token = openai_key
+        else:
+            openai_plugin = LocalLLMPlugin()
         extractor.add_plugin(openai_plugin)
 
+        if llm_api_base:
+            openai_plugin.api_base = llm_api_base
+        if llm_model:
+            openai_plugin.model = llm_model
         if llm_rate_limit_wait:
             openai_plugin.rate_limit_wait = llm_rate_limit_wait
+        if llm_rpm:
+            openai_plugin.rpm = llm_rpm
+        if llm_tpm:
+            openai_plugin.tpm = llm_tpm
+        if llm_concurrency:
+            openai_plugin.concurrency = llm_concurrency
+        openai_plugin.max_request_tokens = llm_max_tokens
 
+    # tf-idf needs the whole corpus, no row is final before it finishes
+    # only the files selected in this run, not everything in the cache
+    start = time.perf_counter()
     result = extractor.extract()
+    export_csv((result.file_results[each] for each in extractor.config.file_list), output_csv)
+    result.metrics.add_time("total", time.perf_counter() - start)
+
+    if profile:
+        click.echo(result.metrics.to_json(), err=True)
+    if metrics_output:
+        result.metrics.dump(metrics_output)
+
+
+@main.command()
+@click.option("--repo", default=".")
+@click.option("--include", default="**")
+@click.option("--stopword_txt", default="")
+@click.option("--file_level", type=FILE_LEVEL_CHOICE)
+@click.option("--jobs", default=1, help="worker processes for keyword extraction")
+@click.option("--cache_backend", default="SQLITE", type=click.Choice([each.value for each in CacheBackendEnum]))
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=7272)
+def serve(
+        repo: str,
+        include: str,
+        stopword_txt: str,
+        file_level: str,
+        jobs: int,
+        cache_backend: str,
+        host: str,
+        port: int,
+):
+    # gfk serve --include "**/*.py"
+    # curl "http://127.0.0.1:7272/keywords?path=a.py"
+    from git_file_keyword.server import KeywordService, serve as run_server
+
+    extractor = create_extractor(repo, stopword_txt, file_level, jobs)
+    extractor.config.include = include
+    extractor.config.cache_backend = CacheBackendEnum(cache_backend)
+    run_server(KeywordService(extractor), host, port)
+
+
+@main.command()
+@click.argument("words", nargs=-1, required=True)
+@click.option("--repo", default=".")
+@click.option("--limit", default=20)
+@click.option("--cache_backend", default="SQLITE", type=click.Choice([each.value for each in CacheBackendEnum]))
+def query(words: typing.Tuple[str], repo: str, limit: int, cache_backend: str):
+    # gfk query cache parser
+    # files about any of the words, from the cache of last run
+    extractor = Extractor()
+    extractor.config.repo_root = pathlib.Path(repo).resolve().absolute()
+    extractor.config.cache_backend = CacheBackendEnum(cache_backend)
+    err = extractor.config.verify()
+    if err:
+        raise click.ClickException(f"invalid repo {repo}: {err!r}")
+    for each in extractor.query_keyword(words, limit):
+        click.echo(f"{each.score:.4f}\t{each.freq}\t{each.path}")
+
+
+def parse_shard(ctx: click.Context, param: click.Parameter, value: str) -> typing.Tuple[int, int]:
+    # "2/4" -> (2, 4)
+    try:
+        index, count = (int(each) for each in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("should be like 1/4")
+    if not 1 <= index <= count:
+        raise click.BadParameter(f"index should be in 1..{count}")
+    return index, count
+
+
+@main.command()
+@click.option("--repo", default=".")
+@click.option("--include", default="**")
+@click.option("--stopword_txt", default="")
+@click.option("--file_level", type=FILE_LEVEL_CHOICE)
+@click.option("--follow_renames", is_flag=True)
+@click.option("--queue", required=True, help="dir shared by all the workers")
+def plan(repo: str, include: str, stopword_txt: str, file_level: str, follow_renames: bool, queue: str):
+    # gfk plan --include "**/*.py" --queue /shared/gfk
+    # then `gfk work --shard i/n` on each machine, and `gfk merge`
+    from git_file_keyword.distributed import WorkQueue
+
+    extractor = create_extractor(repo, stopword_txt, file_level, 1)
+    extractor.config.include = include
+    extractor.config.follow_renames = follow_renames
+    manifest = WorkQueue(queue).plan(extractor)
+    click.echo(f"units: {len(manifest.units)}, head: {manifest.head}")
+
+
+@main.command()
+@click.option("--repo", default=".")
+@click.option("--stopword_txt", default="", help="should be the same as plan")
+@click.option("--jobs", default=1, help="worker processes for keyword extraction")
+@click.option("--queue", required=True)
+@click.option("--shard", required=True, callback=parse_shard, help="e.g. 1/4, starts from 1")
+def work(repo: str, stopword_txt: str, jobs: int, queue: str, shard: typing.Tuple[int, int]):
+    from git_file_keyword.distributed import WorkQueue
+
+    # file level and follow_renames come from the manifest
+    extractor = create_extractor(repo, stopword_txt, "", jobs)
+    WorkQueue(queue).work(extractor, *shard)
+
+
+@main.command()
+@click.option("--queue", required=True)
+@click.option("--output_csv", default="./output.csv")
+def merge(queue: str, output_csv: str):
+    from git_file_keyword.distributed import WorkQueue
+
+    result = WorkQueue(queue).merge(Extractor())
     result.export_csv(output_csv)
 
 
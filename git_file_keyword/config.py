@@ -1,5 +1,5 @@
-import glob
-import os
+import hashlib
+import json
 import pathlib
 import typing
 from enum import Enum
@@ -10,6 +10,8 @@ from loguru import logger
 
 from git_file_keyword import stopword
 from git_file_keyword.exception import MaybeException
+from git_file_keyword.history import list_tracked_files
+from git_file_keyword.utils import glob_to_regex
 
 # https://maartengr.github.io/KeyBERT/faq.html#which-embedding-model-works-best-for-which-language
 MODEL_KEYBERT_DEFAULT = 'all-MiniLM-L6-v2'
@@ -21,20 +23,49 @@ class FileLevelEnum(str, Enum):
     DIR: str = "DIR"
 
 
+class CacheBackendEnum(str, Enum):
+    JSONL: str = "JSONL"
+    SQLITE: str = "SQLITE"
+    # jsonl split by hash of path, for parallel runs on one repo
+    SHARDED: str = "SHARDED"
+
+
 class ExtractConfig(BaseModel):
     repo_root: pathlib.Path = pathlib.Path(".")
     file_list: typing.List[pathlib.Path] = []
+    # glob pattern of tracked files (relative to repo root), if file_list is empty
+    # e.g. `**/*.py`
+    include: str = "**"
 
     # if disabled, cache dir will be removed before run
     cache_enabled: bool = True
+    cache_backend: CacheBackendEnum = CacheBackendEnum.SQLITE
+    # SHARDED only
+    cache_shards: int = 64
     stopword_set: typing.Set[str] = stopword.stopword_set
 
     # extractor algo
     keybert_model: str = MODEL_KEYBERT_DEFAULT
     keybert_keyword_limit: int = 16
+    # docs per keybert call, larger batches are faster
+    keybert_batch_size: int = 512
+    # segmented commit messages kept in memory (lru)
+    tokenizer_cache_size: int = 100_000
+    # keep them in cache dir for next run
+    tokenizer_cache_persist: bool = False
+    # reuse the model loaded by other extractors in this process
+    share_model: bool = True
+    # processes for keybert, each of them loads its own model
+    workers: int = 1
     max_word_length: int = 32
     max_depth_limit: int = 128
+    # history of a moved file includes the commits before the move
+    # renames are detected once for each commit and cached
+    follow_renames: bool = False
     file_level: FileLevelEnum = FileLevelEnum.FILE
+    # DIR level only, files are grouped by their ancestor dir at this depth
+    # e.g. 1 for `a/` of `a/b/c.py`, 0 means the parent dir
+    dir_depth: int = 0
 
     # if len(keywords) > 20
     # remove words which freq <= 0
@@ -48,6 +79,46 @@ class ExtractConfig(BaseModel):
     # commit regex
     commit_regex: str = ""
 
+    # only files touched since the last run will be updated
+    # see `Extractor.extract`
+    incremental: bool = False
+
+    def get_cache_dir(self) -> pathlib.Path:
+        # each git repo has its own .gfk_cache
+        ret = pathlib.Path(self.repo_root) / ".gfk_cache"
+        ret.mkdir(exist_ok=True)
+        return ret
+
+    def keybert_fingerprint(self) -> str:
+        # everything which can change the keybert output of a single commit
+        data = {
+            "model": self.keybert_model,
+            "top_n": self.keybert_keyword_limit,
+            "stopword": sorted(self.stopword_set),
+            "tokenizer": "jieba",
+        }
+        return hashlib.sha1(
+            json.dumps(data, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def fingerprint(self) -> str:
+        # everything which can change the word_freq of files
+        data = {
+            "keybert": self.keybert_fingerprint(),
+            "max_word_length": self.max_word_length,
+            "max_depth_limit": self.max_depth_limit,
+            "follow_renames": self.follow_renames,
+            # may be assigned as a plain str
+            "file_level": FileLevelEnum(self.file_level).value,
+            "dir_depth": self.dir_depth,
+            "ignore_low_freq_if_len": self.ignore_low_freq_if_len,
+            "ignore_low_freq": self.ignore_low_freq,
+            "commit_regex": self.commit_regex,
+        }
+        return hashlib.sha1(
+            json.dumps(data, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
     def verify(self) -> MaybeException:
         return self._verify_git() or self._verify_path()
 
@@ -60,31 +131,25 @@ class ExtractConfig(BaseModel):
 
     def _verify_path(self) -> MaybeException:
         git_repo = git.Repo(self.repo_root)
-        git_track_files = set([each[1].path for each in git_repo.index.iter_blobs()])
+        # path list from git index, files in work tree will not be touched one by one
+        git_track_files = list_tracked_files(git_repo)
 
         if not self.file_list:
-            logger.debug("file list is empty, use **/* instead")
+            logger.debug(f"file list is empty, use tracked files matching {self.include}")
+            include_regex = glob_to_regex(self.include)
             self.file_list = [
-                pathlib.Path(each).resolve()
-                for each in glob.glob(
-                    os.path.join(self.repo_root, "**/*"), recursive=True
-                )
+                pathlib.Path(each) for each in git_track_files if include_regex.match(each)
             ]
+            return None
 
         # file_list can be rel/abs
-        real_file_list = []
+        git_track_file_set = set(git_track_files)
+        final = []
         for each_file in self.file_list:
             each_file = pathlib.Path(each_file)
             if each_file.is_absolute():
                 each_file = pathlib.Path(each_file).relative_to(self.repo_root)
-            real_file_list.append(each_file)
-
-        final = []
-        for each_file in real_file_list:
-            if not (self.repo_root / each_file).is_file():
-                continue
-
-            if each_file.as_posix() not in git_track_files:
+            if each_file.as_posix() not in git_track_file_set:
                 continue
             final.append(each_file)
 
@@ -0,0 +1,187 @@
+import pathlib
+import re
+import shutil
+import typing
+
+import git
+from loguru import logger
+from pydantic import BaseModel
+
+from git_file_keyword.cache import atomic_write
+from git_file_keyword.config import FileLevelEnum
+from git_file_keyword.extractor import Extractor
+from git_file_keyword.history import CommitIndex
+from git_file_keyword.result import Result, FileResult
+
+
+class WorkUnit(BaseModel):
+    # file path, or the dir of its files in DIR level
+    name: str = ""
+    files: typing.List[str] = list()
+    # related commits from `Manifest.head`, at most `max_depth_limit`
+    # used as the cost when splitting shards
+    commits: int = 0
+
+
+class Manifest(BaseModel):
+    # every worker should check out this commit
+    head: str = ""
+    # `ExtractConfig.fingerprint`, workers with other configs are refused
+    fingerprint: str = ""
+    file_level: FileLevelEnum = FileLevelEnum.FILE
+    dir_depth: int = 0
+    follow_renames: bool = False
+    units: typing.List[WorkUnit] = list()
+
+    def files(self) -> typing.List[str]:
+        return [each_file for each in self.units for each_file in each.files]
+
+    def shard(self, index: int, count: int) -> typing.List[WorkUnit]:
+        # index starts from 1, like `--shard 1/4`
+        # biggest units first, each one goes to the least loaded shard
+        assert 1 <= index <= count, f"invalid shard: {index}/{count}"
+        loads = [0] * count
+        ret = []
+        for each in sorted(self.units, key=lambda x: (-x.commits, x.name)):
+            target = loads.index(min(loads))
+            loads[target] += each.commits + 1
+            if target == index - 1:
+                ret.append(each)
+        return ret
+
+
+class WorkQueue(object):
+    """
+    Spread one extraction over several machines with a shared dir.
+
+    - plan: split the files into units (files or dirs, same as `Extractor`) and save the manifest
+    - work: any machine runs one shard of the units, and writes the word_freq of its files
+    - merge: collect all the partial results and apply plugins (tf-idf) once over the union
+
+    queue_dir/
+        manifest.json
+        partial/<index>-<count>.jsonl
+    """
+
+    def __init__(self, queue_dir: typing.Union[str, pathlib.Path]):
+        self.queue_dir = pathlib.Path(queue_dir)
+
+    def get_manifest_file(self) -> pathlib.Path:
+        return self.queue_dir / "manifest.json"
+
+    def get_partial_dir(self) -> pathlib.Path:
+        return self.queue_dir / "partial"
+
+    def get_partial_file(self, index: int, count: int) -> pathlib.Path:
+        return self.get_partial_dir() / f"{index}-{count}.jsonl"
+
+    def read_manifest(self) -> Manifest:
+        return Manifest.model_validate_json(self.get_manifest_file().read_text(encoding="utf-8"))
+
+    def plan(self, extractor: Extractor) -> Manifest:
+        config = extractor.config
+        err = config.verify()
+        if err:
+            raise err
+        repo = git.Repo(config.repo_root)
+
+        unit_dict: typing.Dict[str, typing.List[str]] = dict()
+        for each in config.file_list:
+            path = each.as_posix()
+            if config.file_level == FileLevelEnum.FILE:
+                name = path
+            else:
+                name = extractor._group_dir(path)
+            unit_dict.setdefault(name, []).append(path)
+
+        # one walk for the costs of all the units, messages are not extracted here
+        commit_regex = re.compile(config.commit_regex) if config.commit_regex else None
+        commit_index = CommitIndex(
+            repo,
+            config.max_depth_limit,
+            commit_regex,
+            renames=extractor.read_commit_renames() if config.follow_renames else None,
+        )
+        if config.file_level == FileLevelEnum.FILE:
+            commit_index.build(file_paths=unit_dict.keys())
+        else:
+            commit_index.build(dir_paths=unit_dict.keys())
+        extractor.write_commit_renames(commit_index.new_renames)
+
+        manifest = Manifest(
+            head=repo.head.commit.hexsha,
+            fingerprint=config.fingerprint(),
+            file_level=config.file_level,
+            dir_depth=config.dir_depth,
+            follow_renames=config.follow_renames,
+            units=[
+                WorkUnit(name=name, files=files, commits=len(commit_index.get(name)))
+                for name, files in unit_dict.items()
+            ],
+        )
+
+        # partial results of the last plan are useless now
+        shutil.rmtree(self.get_partial_dir(), ignore_errors=True)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.get_manifest_file(), [manifest.model_dump_json()])
+        logger.info(f"manifest saved: {len(manifest.units)} units, {len(config.file_list)} files")
+        return manifest
+
+    def work(self, extractor: Extractor, index: int, count: int) -> pathlib.Path:
+        manifest = self.read_manifest()
+        config = extractor.config
+        config.file_level = manifest.file_level
+        config.dir_depth = manifest.dir_depth
+        config.follow_renames = manifest.follow_renames
+        if config.fingerprint() != manifest.fingerprint:
+            raise ValueError("config of this worker is different from the manifest, check stopwords and model")
+        repo = git.Repo(config.repo_root)
+        if repo.head.commit.hexsha != manifest.head:
+            raise ValueError(f"worker is on {repo.head.commit.hexsha}, but manifest is planned on {manifest.head}")
+
+        units = manifest.shard(index, count)
+        files = [each_file for each in units for each_file in each.files]
+        logger.info(f"shard {index}/{count}: {len(units)} units, {len(files)} files")
+
+        file_results: typing.List[FileResult] = []
+        if files:
+            config.file_list = [pathlib.Path(each) for each in files]
+            # tf-idf needs the whole corpus, plugins run in `merge`
+            file_results = list(extractor.extract_iter(apply_plugins=False))
+
+        self.get_partial_dir().mkdir(parents=True, exist_ok=True)
+        partial_file = self.get_partial_file(index, count)
+        atomic_write(
+            partial_file,
+            (
+                FileResult(path=each.path, checksum=each.checksum, word_freq=each.word_freq).model_dump_json()
+                for each in file_results
+            ),
+        )
+        logger.info(f"partial result saved: {partial_file}")
+        return partial_file
+
+    def merge(self, extractor: Extractor) -> Result:
+        manifest = self.read_manifest()
+        partial_dict: typing.Dict[str, FileResult] = dict()
+        for each in sorted(self.get_partial_dir().glob("*.jsonl")):
+            with open(each, "r", encoding="utf-8") as f:
+                for line in f:
+                    file_result = FileResult.model_validate_json(line.strip())
+                    partial_dict[file_result.path] = file_result
+
+        files = manifest.files()
+        missing = [each for each in files if each not in partial_dict]
+        if missing:
+            raise ValueError(f"{len(missing)} files have no partial result (e.g. {missing[0]}), "
+                             f"are all the shards finished?")
+
+        # same order as the manifest
+        result = Result()
+        for each in files:
+            result.file_results[pathlib.Path(each)] = partial_dict[each]
+        for each in extractor._plugins:
+            with result.metrics.timer(f"plugin:{each.plugin_id()}"):
+                each.apply(extractor.config, result)
+        logger.info(f"merged {len(files)} files")
+        return result
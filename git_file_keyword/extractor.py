@@ -1,29 +1,39 @@
+import json
+import math
+import multiprocessing
 import os
 import pathlib
 import re
 import shutil
 import typing
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import git
-from keybert import KeyBERT
 from loguru import logger
-from sklearn.feature_extraction.text import CountVectorizer
-import rjieba as jieba
 
+from git_file_keyword.cache import BaseCacheBackend, create_cache_backend
 from git_file_keyword.config import ExtractConfig, FileLevelEnum
-from git_file_keyword.plugin import TfidfPlugin, BasePlugin
-from git_file_keyword.result import Result, FileResult
-from git_file_keyword.utils import calc_checksum, strip_symbol
+from git_file_keyword.history import CommitIndex, CommitTable, diff_paths
+from git_file_keyword.metrics import Metrics
+from git_file_keyword.model import load_keybert
+from git_file_keyword.plugin import TfidfPlugin, BasePlugin, TFIDF_PLUGIN_ID
+from git_file_keyword.result import Result, FileResult, KeywordHit
+from git_file_keyword.tokenizer import CachedTokenizer
+from git_file_keyword.utils import calc_checksum, strip_symbol, split_list
 
+# head commit and config of last run, for incremental mode
+META_LAST_RUN = "last_run"
+META_PLUGIN_STATE_PREFIX = "plugin_state:"
 
-class _ConfigBase(object):
-    _plugins: typing.List[BasePlugin] = [
-        TfidfPlugin(),
-    ]
 
+class _ConfigBase(object):
     def __init__(self, config: ExtractConfig = None):
         self.config = config or ExtractConfig()
+        # per extractor, `add_plugin` never changes the others
+        self._plugins: typing.List[BasePlugin] = [
+            TfidfPlugin(),
+        ]
 
     def add_stopwords_file(self, txt: str):
         txt_path = pathlib.Path(txt)
@@ -37,40 +47,171 @@ class _ConfigBase(object):
 
 
 class _CacheBase(_ConfigBase):
+    # long-running process (e.g. `gfk serve`) keeps the cache in memory
+    # everything is still written to the cache, but never read back
+    keep_in_memory = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache_backend: typing.Optional[BaseCacheBackend] = None
+        # path -> json which is the same as the one in cache
+        # only the changed rows will be written
+        self._cache_snapshot: typing.Dict[str, str] = dict()
+        # results of the last run, and commit tokens of each keybert fingerprint
+        self._memory_file_results: typing.Optional[typing.Dict[pathlib.Path, FileResult]] = None
+        self._memory_commit_tokens: typing.Dict[str, typing.Dict[str, typing.Set[str]]] = dict()
+        self._memory_commit_renames: typing.Optional[typing.Dict[str, typing.List[typing.List[str]]]] = None
+        # metrics of current run, same as `Result.metrics`
+        self.metrics = Metrics()
+
     def get_cache_dir(self) -> pathlib.Path:
-        # each git repo has its own .gfk_cache
-        ret = self.config.repo_root / ".gfk_cache"
-        ret.mkdir(exist_ok=True)
-        return ret
+        return self.config.get_cache_dir()
 
-    def get_cache_word_file(self) -> pathlib.Path:
-        return self.get_cache_dir() / "word.txt"
+    def get_cache_backend(self) -> BaseCacheBackend:
+        if self._cache_backend is None:
+            self._cache_backend = create_cache_backend(self.config)
+        return self._cache_backend
 
     def write_fs(self, result: Result):
-        word = self.get_cache_word_file()
-        logger.debug(f"save result to cache: {word}")
-
-        with open(word, "w+", encoding="utf-8") as f:
-            for file_result in result.file_results.values():
-                f.write(file_result.model_dump_json(exclude_unset=True) + os.linesep)
+        with self.metrics.timer("cache_write"):
+            self._write_fs(result)
+
+    def _write_fs(self, result: Result):
+        changed = []
+        for file_result in result.file_results.values():
+            data = BaseCacheBackend.dump_file_result(file_result)
+            if self._cache_snapshot.get(file_result.path) != data:
+                changed.append(file_result)
+                self._cache_snapshot[file_result.path] = data
+        if not changed:
+            return
+
+        logger.debug(f"save {len(changed)} results to cache: {self.get_cache_dir()}")
+        self.metrics.incr("cache_rows_written", len(changed))
+        self.get_cache_backend().write(changed)
 
     def read_fs(self) -> typing.Optional[Result]:
-        word = self.get_cache_word_file()
-        logger.info(f"load result from cache: {word}")
+        with self.metrics.timer("cache_read"):
+            return self._read_fs()
 
-        if not word.exists():
+    def _read_fs(self) -> typing.Optional[Result]:
+        if self._memory_file_results is not None:
+            # snapshot is still in sync, all the changes have been written
+            file_results = dict(self._memory_file_results)
+        else:
+            logger.info(f"load result from cache: {self.get_cache_dir()}")
+            file_results = self.get_cache_backend().load()
+            self._cache_snapshot = {
+                each.path: BaseCacheBackend.dump_file_result(each)
+                for each in file_results.values()
+            }
+        if not file_results:
             return None
+        for each in file_results.values():
+            each.cached = True
 
         result = Result()
-        with open(word, "r", encoding="utf-8") as f:
-            for line in f:
-                file_result: FileResult = FileResult.model_validate_json(line.strip())
-                result.file_results[pathlib.Path(file_result.path)] = file_result
-
+        result.file_results.update(file_results)
         return result
 
+    def read_commit_tokens(self, shas: typing.Iterable[str]) -> typing.Dict[str, typing.Set[str]]:
+        with self.metrics.timer("cache_read"):
+            return self._read_commit_tokens(shas)
+
+    def _read_commit_tokens(self, shas: typing.Iterable[str]) -> typing.Dict[str, typing.Set[str]]:
+        # commit sha -> tokens, extracted with current keybert config
+        # commits without tokens in cache are not in it
+        fingerprint = self.config.keybert_fingerprint()
+        memory = self._memory_commit_tokens.get(fingerprint, dict())
+        ret = dict()
+        missing = []
+        for sha in shas:
+            if sha in memory:
+                ret[sha] = memory[sha]
+            else:
+                missing.append(sha)
+        if not missing:
+            return ret
+
+        loaded = self.get_cache_backend().read_commit_tokens(fingerprint, missing)
+        ret.update(loaded)
+        if self.keep_in_memory:
+            self._memory_commit_tokens.setdefault(fingerprint, dict()).update(loaded)
+        return ret
+
+    def write_commit_tokens(self, commit_tokens: typing.Dict[str, typing.Set[str]]):
+        if not commit_tokens:
+            return
+        fingerprint = self.config.keybert_fingerprint()
+        logger.debug(f"save {len(commit_tokens)} commits to cache: {self.get_cache_dir()}")
+        with self.metrics.timer("cache_write"):
+            self.get_cache_backend().write_commit_tokens(fingerprint, commit_tokens)
+        if fingerprint in self._memory_commit_tokens:
+            self._memory_commit_tokens[fingerprint].update(commit_tokens)
+
+    def read_commit_renames(self) -> typing.Dict[str, typing.List[typing.List[str]]]:
+        with self.metrics.timer("cache_read"):
+            if self._memory_commit_renames is not None:
+                return dict(self._memory_commit_renames)
+            ret = self.get_cache_backend().read_commit_renames()
+            if self.keep_in_memory:
+                self._memory_commit_renames = dict(ret)
+            return ret
+
+    def write_commit_renames(self, commit_renames: typing.Dict[str, typing.List[typing.List[str]]]):
+        if not commit_renames:
+            return
+        with self.metrics.timer("cache_write"):
+            self.get_cache_backend().write_commit_renames(commit_renames)
+        if self._memory_commit_renames is not None:
+            self._memory_commit_renames.update(commit_renames)
+
+    def query_keyword(self, words: typing.Iterable[str], limit: int = 20) -> typing.List[KeywordHit]:
+        # files about these words, from the cache of last run
+        # words in results are lowercase
+        words = [each.strip().lower() for each in words if each.strip()]
+        return self.get_cache_backend().query_keyword(words, limit)
+
+    def read_meta(self, key: str) -> typing.Optional[str]:
+        return self.get_cache_backend().read_meta(key)
+
+    def write_meta(self, key: str, value: str):
+        self.get_cache_backend().write_meta(key, value)
+
+    def read_plugin_state(self, result: Result):
+        if self.get_cache_backend().concurrent:
+            # other runs change the rows without updating it, rebuilt in each run
+            return
+        with self.metrics.timer("cache_read"):
+            for each in self._plugins:
+                state = self.read_meta(META_PLUGIN_STATE_PREFIX + each.plugin_id())
+                if state:
+                    result.plugin_state[each.plugin_id()] = json.loads(state)
+
+    def write_plugin_state(self, result: Result):
+        if self.get_cache_backend().concurrent:
+            return
+        with self.metrics.timer("cache_write"):
+            for plugin_id, state in result.plugin_state.items():
+                key = META_PLUGIN_STATE_PREFIX + plugin_id
+                data = json.dumps(state, ensure_ascii=False, sort_keys=True)
+                if self.read_meta(key) != data:
+                    self.write_meta(key, data)
+            # rows may have changed without tf-idf (e.g. `gfk work`), its state is stale
+            if TFIDF_PLUGIN_ID not in result.plugin_state:
+                key = META_PLUGIN_STATE_PREFIX + TFIDF_PLUGIN_ID
+                if self.read_meta(key):
+                    self.write_meta(key, "")
+
     def clear_cache(self):
         # careful !!
+        if self._cache_backend is not None:
+            self._cache_backend.close()
+            self._cache_backend = None
+        self._cache_snapshot = dict()
+        self._memory_file_results = None
+        self._memory_commit_tokens = dict()
+        self._memory_commit_renames = None
         shutil.rmtree(self.get_cache_dir())
 
 
@@ -78,21 +219,69 @@ class Extractor(_CacheBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.kw_model = KeyBERT(model=self.config.keybert_model)
+        # heavy, created on the first use
+        # a run which hits the cache only should not pay for them
+        self._kw_model = None
+        self._vectorizer = None
+        self.tokenizer = CachedTokenizer(self.config.tokenizer_cache_size)
         # supress warning
         os.putenv("TOKENIZERS_PARALLELISM", "False")
-        # convert to list for keybert
-        self.stopword_list = list(self.config.stopword_set)
 
-        # https://maartengr.github.io/KeyBERT/faq.html#how-can-i-use-keybert-with-chinese-documents
-        def tokenize_zh(text):
-            words = jieba.cut(text)
-            return words
+    @property
+    def kw_model(self):
+        if self._kw_model is None:
+            with self.metrics.timer("model_load"):
+                self._kw_model = load_keybert(
+                    self.config.keybert_model, shared=self.config.share_model
+                )
+        return self._kw_model
+
+    @property
+    def vectorizer(self):
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import CountVectorizer
+
+            if self.config.tokenizer_cache_persist:
+                self.tokenizer.load(self._get_segment_file())
+            self._vectorizer = CountVectorizer(tokenizer=self.tokenizer)
+        return self._vectorizer
 
-        self.vectorizer = CountVectorizer(tokenizer=tokenize_zh)
+    def _get_segment_file(self) -> pathlib.Path:
+        return self.get_cache_dir() / "segment.txt"
+
+    @property
+    def stopword_list(self) -> typing.List[str]:
+        # convert to list for keybert
+        return list(self.config.stopword_set)
 
     def extract(self) -> Result:
-        err = self.config.verify()
+        result = Result()
+        for _ in self._extract_iter(result, streaming=False):
+            pass
+        return result
+
+    def extract_iter(self, result: Result = None, apply_plugins: bool = True) -> typing.Iterator[FileResult]:
+        """
+        Yield the result of each file in `config.file_list` once it is final.
+        Commit lists are released once the word_freq of all the groups are built.
+
+        With `apply_plugins=False`, rows with word_freq only (no keywords) are yielded one by one,
+        cached files first, then each file as soon as its words are ready.
+        Plugins like tf-idf (enabled by default) need the whole corpus,
+        so with them nothing is yielded before all the plugins applied.
+
+        `result` is still filled with all the file results (including cached ones).
+        """
+        if result is None:
+            result = Result()
+        yield from self._extract_iter(result, streaming=True, apply_plugins=apply_plugins)
+
+    def _extract_iter(
+            self, result: Result, streaming: bool, apply_plugins: bool = True
+    ) -> typing.Iterator[FileResult]:
+        result.metrics = self.metrics = Metrics()
+        with self.metrics.timer("verify"):
+            err = self.config.verify()
         if err:
             raise err
         logger.info("config validation ok")
@@ -102,14 +291,86 @@ class Extractor(_CacheBase):
         # cache
         if not self.config.cache_enabled:
             self.clear_cache()
-        result = self.read_fs()
-        if not result:
+        cached_result = self.read_fs()
+        if cached_result:
+            result.file_results.update(cached_result.file_results)
+        else:
             logger.info("no cache found")
-            result = Result()
 
-        # check tasks
+        with self.metrics.timer("checksum"):
+            file_todo = self._check_tasks(repo, result)
+        self.metrics.incr("files_total", len(self.config.file_list))
+        self.metrics.incr("files_todo", len(file_todo))
+        self.metrics.incr("files_cached", len(self.config.file_list) - len(file_todo))
+        file_done = self._extract_words(
+            repo, result, file_todo, release_commits=streaming
+        )
+
+        if streaming and not (apply_plugins and self._plugins):
+            # nothing to wait, files are final once their words are ready
+            for file_path in self.config.file_list:
+                if result.file_results[file_path].cached:
+                    yield result.file_results[file_path]
+            yield from file_done
+            self._save(repo, result)
+            logger.info("ok")
+            return
+
+        for _ in file_done:
+            pass
+        # write cache
+        self.write_fs(result)
+
+        # apply plugins
+        # in plugins, dev can decide using cache or not by `FileResult.cached`
+        self.read_plugin_state(result)
+        for each in self._plugins:
+            with self.metrics.timer(f"plugin:{each.plugin_id()}"):
+                each.apply(self.config, result)
+
+        # update cache
+        self._save(repo, result)
+        logger.info("ok")
+
+        if streaming:
+            for file_path in self.config.file_list:
+                yield result.file_results[file_path]
+
+    def _save(self, repo: git.Repo, result: Result):
+        self.write_fs(result)
+        self.write_plugin_state(result)
+        with self.metrics.timer("cache_write"):
+            self._save_last_run(repo)
+        if self.keep_in_memory:
+            self._memory_file_results = dict(result.file_results)
+
+    def _check_tasks(self, repo: git.Repo, result: Result) -> typing.List[FileResult]:
+        # git index already knows the blob sha of the files which are not touched
+        index_entries = {
+            path: entry
+            for (path, stage), entry in repo.index.entries.items()
+            if stage == 0
+        }
+        index_mtime = os.stat(repo.index.path).st_mtime
+
+        # incremental: files touched by new commits should be renewed
+        # even if their content does not change
+        touched_set = None
+        if self.config.incremental:
+            touched_set = self._get_touched_paths(repo)
+            if touched_set is None:
+                logger.info("incremental mode is not available, check all the files")
+            else:
+                logger.info(f"incremental mode, touched paths: {len(touched_set)}")
+
+        fingerprint = self.config.fingerprint()
         file_todo: typing.List[FileResult] = []
         for file_path in self.config.file_list:
+            cur_checksum = calc_checksum(
+                self.config.repo_root / file_path,
+                index_entries.get(file_path.as_posix()),
+                index_mtime,
+            )
             if file_path not in result.file_results:
                 # new file
                 new_file_result = FileResult()
@@ -117,122 +378,327 @@ class Extractor(_CacheBase):
 
                 # result should be serializable
                 new_file_result.path = file_path.as_posix()
-                new_file_result.checksum = calc_checksum(
-                    self.config.repo_root / file_path
-                )
+                new_file_result.checksum = cur_checksum
+                new_file_result.fingerprint = fingerprint
                 result.file_results[file_path] = new_file_result
             else:
                 # old file, check checksum
                 cached_file_result = result.file_results[file_path]
-                cur_checksum = calc_checksum(self.config.repo_root / file_path)
-                if cached_file_result.checksum != cur_checksum:
-                    # should be renewed
+                renew = False
+                if cached_file_result.fingerprint != fingerprint:
+                    # word_freq comes from other settings, e.g. file_level or follow_renames
+                    logger.info(f"{file_path} config changed, recalc")
+                    renew = True
+                elif cached_file_result.checksum != cur_checksum:
                     logger.info(f"{file_path} checksum mismatch, recalc")
+                    renew = True
+                elif touched_set is not None and self._is_touched(file_path, touched_set):
+                    logger.info(f"{file_path} touched by new commits, recalc")
+                    renew = True
+
+                if renew:
+                    result._renewed[file_path] = cached_file_result
                     new_file_result = FileResult()
+                    file_todo.append(new_file_result)
                     new_file_result.path = file_path.as_posix()
                     new_file_result.checksum = cur_checksum
+                    new_file_result.fingerprint = fingerprint
                     result.file_results[file_path] = new_file_result
-
-        # word extract
+        return file_todo
+
+    def _extract_words(
+            self,
+            repo: git.Repo,
+            result: Result,
+            file_todo: typing.List[FileResult],
+            release_commits: bool = False,
+    ) -> typing.Iterator[FileResult]:
+        # yield each file once its word_freq is ready
         commit_regex = None
         if self.config.commit_regex:
             commit_regex = re.compile(self.config.commit_regex)
 
+        # each group shares the same commits and the same word_freq
+        groups: typing.List[typing.Tuple[str, typing.List[FileResult]]] = []
+        commit_index = CommitIndex(
+            repo,
+            self.config.max_depth_limit,
+            commit_regex,
+            renames=self.read_commit_renames() if self.config.follow_renames else None,
+        )
         if self.config.file_level == FileLevelEnum.FILE:
-            total = len(file_todo)
-            for cur, file_result in enumerate(file_todo):
-                kwargs = {
-                    "paths": file_result.path,
-                }
-                if self.config.max_depth_limit != -1:
-                    kwargs["max_count"] = self.config.max_depth_limit
-
-                for commit in repo.iter_commits(**kwargs):
-                    if not commit_regex:
-                        file_result._commits.append(commit)
-                        continue
-                    if commit_regex.match(commit.message):
-                        file_result._commits.append(commit)
-
-                self._extract_word_freq_from_commits(file_result)
-                logger.debug(f"progress: {cur + 1}/{total}, "
-                             f"file: {file_result.path}, "
-                             f"related commits: {len(file_result._commits)}, "
-                             f"token: {len(file_result.word_freq)}")
+            # walk the history once for all the files
+            with self.metrics.timer("history_walk"):
+                commit_index.build(file_paths=[each.path for each in file_todo])
+            groups = [(each.path, [each]) for each in file_todo]
         else:
             dir_dict: typing.Dict[str, typing.List[FileResult]] = dict()
             for each in file_todo:
-                each_dir = os.path.dirname(each.path)
+                each_dir = self._group_dir(each.path)
                 if each_dir not in dir_dict:
                     dir_dict[each_dir] = []
                 dir_dict[each_dir].append(each)
-
-            cur = 0
-            total = len(dir_dict)
-            for each_dir, each_file_list in dir_dict.items():
-                # extract once for each dir
-                kwargs = {
-                    "paths": each_dir,
-                }
-                if self.config.max_depth_limit != -1:
-                    kwargs["max_count"] = self.config.max_depth_limit
-
-                related_commits = []
-                for commit in repo.iter_commits(**kwargs):
-                    if not commit_regex:
-                        related_commits.append(commit)
-                        continue
-                    if commit_regex.match(commit.message):
-                        related_commits.append(commit)
-                commit_msg_list = [
-                    each_commit.message.strip()
-                    for each_commit
-                    in related_commits
-                ]
-                word_freq = self._extract_word_freq_from_docs(commit_msg_list)
-                for each_file in each_file_list:
+            # nested dirs are matched in the same walk
+            with self.metrics.timer("history_walk"):
+                commit_index.build(dir_paths=dir_dict.keys())
+            groups = list(dir_dict.items())
+
+        self.metrics.incr("commit_renames_detected", len(commit_index.new_renames))
+        self.write_commit_renames(commit_index.new_renames)
+
+        # commits never change, so their tokens can be reused across runs
+        commit_table = commit_index.table
+        if not release_commits:
+            result._commit_table = commit_table
+        commit_tokens = self.read_commit_tokens(
+            commit_table.sha(commit_id) for commit_id in range(len(commit_table))
+        )
+        new_commits = [
+            commit_id
+            for commit_id in range(len(commit_table))
+            if commit_table.sha(commit_id) not in commit_tokens
+        ]
+        logger.info(f"related commits: {len(commit_table)}, "
+                    f"new: {len(new_commits)}")
+        self.metrics.incr("commits_scanned", commit_index.scanned)
+        self.metrics.incr("commits_related", len(commit_table))
+        self.metrics.incr("commits_new", len(new_commits))
+        self.metrics.incr("commit_tokens_cached", len(commit_table) - len(new_commits))
+
+        # extract keywords from all the new commits at once
+        # most commits touch many files, so each message should be embedded only once
+        with self.metrics.timer("keyword_extraction"):
+            doc_tokens = self._extract_tokens_from_docs(
+                [commit_table.message(commit_id).strip() for commit_id in new_commits]
+            )
+        new_commit_tokens = {
+            commit_table.sha(commit_id): doc_tokens.get(
+                commit_table.message(commit_id).strip(), set()
+            )
+            for commit_id in new_commits
+        }
+        self.write_commit_tokens(new_commit_tokens)
+        commit_tokens.update(new_commit_tokens)
+        del new_commits, doc_tokens
+
+        group_commits = [
+            commit_index.pop(group_name) if release_commits else commit_index.get(group_name)
+            for group_name, _ in groups
+        ]
+        with self.metrics.timer("aggregation"):
+            word_freq_list = self._aggregate_word_freq(commit_table, commit_tokens, group_commits)
+        del commit_tokens
+
+        total = len(groups)
+        for cur, (group_name, each_file_list) in enumerate(groups):
+            related_commits = group_commits[cur]
+            word_freq = word_freq_list[cur]
+            logger.debug(f"progress: {cur + 1}/{total}, "
+                         f"{self.config.file_level.lower()}: {group_name}, "
+                         f"related commits: {len(related_commits)}, "
+                         f"tokens: {len(word_freq)}")
+            for each_file in each_file_list:
+                if not release_commits:
                     each_file._commits = related_commits
-                    each_file.word_freq = word_freq
-                logger.debug(f"progress: {cur + 1}/{total}, "
-                             f"dir: {each_dir}, "
-                             f"related commits: {len(related_commits)}, "
-                             f"tokens: {len(word_freq)}")
-                cur += 1
+                each_file.word_freq = word_freq
+            # release as early as possible
+            group_commits[cur] = None
+            word_freq_list[cur] = None
+            yield from each_file_list
+
+    def _aggregate_word_freq(
+            self,
+            commit_table: CommitTable,
+            commit_tokens: typing.Dict[str, typing.Set[str]],
+            group_commits: typing.List[typing.Sequence[int]],
+    ) -> typing.List[dict]:
+        # tokens of a group = union of the tokens of its commits
+        # (groups x commits) @ (commits x tokens), instead of merging sets for each group
+        if not len(commit_table):
+            return [self._count_words([]) for _ in group_commits]
+
+        import numpy as np
+        from scipy.sparse import csr_matrix
+
+        vocabulary: typing.Dict[str, int] = dict()
+        indptr = [0]
+        indices = []
+        for commit_id in range(len(commit_table)):
+            for token in commit_tokens[commit_table.sha(commit_id)]:
+                indices.append(vocabulary.setdefault(token, len(vocabulary)))
+            indptr.append(len(indices))
+        commit_matrix = csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(commit_table), len(vocabulary)),
+        )
 
-        # write cache
-        self.write_fs(result)
+        indptr = np.zeros(len(group_commits) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(each) for each in group_commits])
+        indices = np.fromiter(
+            (commit_id for each in group_commits for commit_id in each),
+            dtype=np.int64,
+            count=int(indptr[-1]),
+        )
+        group_matrix = csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(group_commits), len(commit_table)),
+        )
+        group_token_matrix = (group_matrix @ commit_matrix).tocsr()
+
+        # each token is filtered only once
+        names = [self.filter_name(each) for each in vocabulary]
+        ret = []
+        for i in range(len(group_commits)):
+            row = group_token_matrix.indices[
+                  group_token_matrix.indptr[i]: group_token_matrix.indptr[i + 1]
+                  ]
+            ret.append(self._count_words(names[j] for j in row))
+        return ret
 
-        # apply plugins
-        # in plugins, dev can decide using cache or not by `FileResult.cached`
-        for each in self._plugins:
-            each.apply(self.config, result)
+    def _group_dir(self, path: str) -> str:
+        # DIR level, the dir which this file belongs to
+        dir_path = os.path.dirname(path)
+        if self.config.dir_depth <= 0:
+            return dir_path
+        return "/".join(dir_path.split("/")[: self.config.dir_depth])
 
-        # update cache
-        self.write_fs(result)
+    def _last_run_key(self) -> str:
+        # runs on other files (e.g. another subtree) keep their own heads
+        return f"{META_LAST_RUN}:{self.config.include}"
 
-        logger.info("ok")
-        return result
+    def _get_touched_paths(self, repo: git.Repo) -> typing.Optional[typing.Set[str]]:
+        last_run = self.read_meta(self._last_run_key())
+        if not last_run:
+            return None
+        last_run = json.loads(last_run)
+        if last_run["fingerprint"] != self.config.fingerprint():
+            logger.info("config changed since last run")
+            return None
 
-    def _extract_word_freq_from_docs(self, docs: typing.List[str]) -> dict:
-        word_freq = defaultdict(int)
-        tokens = set()
+        touched_set = diff_paths(repo, last_run["head"])
+        if touched_set is None or self.config.file_level == FileLevelEnum.FILE:
+            return touched_set
+
+        # dir: any file in this dir (recursively) has been touched
+        touched_dirs = set()
+        for each in touched_set:
+            parts = each.split("/")
+            for i in range(len(parts)):
+                touched_dirs.add("/".join(parts[:i]))
+        return touched_dirs
 
+    def _is_touched(self, file_path: pathlib.Path, touched_set: typing.Set[str]) -> bool:
+        if self.config.file_level == FileLevelEnum.FILE:
+            return file_path.as_posix() in touched_set
+        return self._group_dir(file_path.as_posix()) in touched_set
+
+    def _save_last_run(self, repo: git.Repo):
+        if not repo.head.is_valid():
+            return
+        last_run = json.dumps({
+            "head": repo.head.commit.hexsha,
+            "fingerprint": self.config.fingerprint(),
+        })
+        if self.read_meta(self._last_run_key()) != last_run:
+            self.write_meta(self._last_run_key(), last_run)
+
+    def _extract_tokens_from_docs(
+            self, docs: typing.List[str]
+    ) -> typing.Dict[str, typing.Set[str]]:
+        # doc -> tokens
+        # duplicated docs will be embedded only once
+        unique_docs = list(dict.fromkeys(each for each in docs if each))
+        if not unique_docs:
+            return dict()
+        self.metrics.incr("docs_embedded", len(unique_docs))
+
+        workers = self.config.workers
+        batch_size = self.config.keybert_batch_size
+        if workers > 1:
+            # make sure that every worker has something to do
+            batch_size = min(batch_size, math.ceil(len(unique_docs) / workers))
+        batches = list(split_list(unique_docs, batch_size))
+        self.metrics.incr("keybert_batches", len(batches))
+
+        if workers > 1 and len(batches) > 1:
+            logger.info(f"extract {len(unique_docs)} docs with {workers} workers")
+            # spawn: forking a process with loaded torch model is not safe
+            with ProcessPoolExecutor(
+                    max_workers=min(workers, len(batches)),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.config,),
+            ) as pool:
+                # map keeps the order, so the result is deterministic
+                tokens_list_iter = pool.map(_extract_tokens_in_worker, batches)
+                batch_tokens_list = list(tokens_list_iter)
+        else:
+            # each word is embedded once for all the batches
+            word_embeddings = dict()
+            hits, misses, seconds = self.tokenizer.hits, self.tokenizer.misses, self.tokenizer.seconds
+            batch_tokens_list = [
+                self._extract_tokens_from_batch(each, word_embeddings) for each in batches
+            ]
+            logger.debug(f"segment cache hits: {self.tokenizer.hits}, "
+                         f"misses: {self.tokenizer.misses}, "
+                         f"embedded words: {len(word_embeddings)}")
+            self.metrics.incr("segment_cache_hits", self.tokenizer.hits - hits)
+            self.metrics.incr("segment_cache_misses", self.tokenizer.misses - misses)
+            self.metrics.add_time(
+                "tokenization", self.tokenizer.seconds - seconds, self.tokenizer.misses - misses
+            )
+            self.metrics.incr("words_embedded", len(word_embeddings))
+            if self.config.tokenizer_cache_persist:
+                self.tokenizer.save(self._get_segment_file())
+
+        ret = dict()
+        for batch, tokens_list in zip(batches, batch_tokens_list):
+            ret.update(zip(batch, tokens_list))
+        return ret
+
+    def _extract_tokens_from_batch(
+            self,
+            batch: typing.List[str],
+            word_embeddings: typing.Optional[dict] = None,
+    ) -> typing.List[typing.Set[str]]:
+        # word_embeddings: word -> embedding, shared by batches
+        # keybert embeds the whole vocabulary of each batch otherwise
+        try:
+            words = self.vectorizer.fit(batch).get_feature_names_out()
+        except ValueError:
+            # empty vocabulary, e.g. symbols only
+            return [set() for _ in batch]
+
+        batch_word_embeddings = None
+        if word_embeddings is not None:
+            import numpy as np
+
+            missing = [each for each in words if each not in word_embeddings]
+            if missing:
+                word_embeddings.update(zip(missing, self.kw_model.model.embed(missing)))
+            batch_word_embeddings = np.array([word_embeddings[each] for each in words])
+
+        # keybert fits the vectorizer again, segments come from the cache this time
         keywords_list = self.kw_model.extract_keywords(
-            docs,
+            batch,
             stop_words=self.stopword_list,
             use_mmr=True,
             top_n=self.config.keybert_keyword_limit,
             vectorizer=self.vectorizer,
+            word_embeddings=batch_word_embeddings,
         )
-        for each_keywords in keywords_list:
-            if isinstance(each_keywords, tuple):
-                tokens.add(each_keywords[0])
-            else:
-                for each_keyword in each_keywords:
-                    tokens.add(each_keyword[0])
-
-        for each in tokens:
-            name = self.filter_name(each)
+        # keybert flattens the output of single doc
+        if len(batch) == 1:
+            keywords_list = [keywords_list]
+        return [
+            set(each_keyword[0] for each_keyword in each_keywords)
+            for each_keywords in keywords_list
+        ]
+
+    def _count_words(self, names: typing.Iterable[str]) -> dict:
+        # names have been filtered, empty ones are dropped
+        word_freq = defaultdict(int)
+        for name in names:
             if name:
                 word_freq[name] += 1
 
@@ -248,15 +714,6 @@ class Extractor(_CacheBase):
 
         return word_freq
 
-    def _extract_word_freq_from_commits(self, file_result: FileResult):
-        commit_msg_list = list()
-        for commit in file_result._commits:
-            commit_msg = commit.message.strip()
-            commit_msg_list.append(commit_msg)
-
-        word_freq = self._extract_word_freq_from_docs(commit_msg_list)
-        file_result.word_freq = word_freq
-
     def filter_name(self, name: str) -> str:
         name = strip_symbol(name.strip())
         if not name:
@@ -276,3 +733,19 @@ class Extractor(_CacheBase):
             return ""
 
         return name
+
+
+# process pool workers
+# each worker process holds its own extractor, so the model will be loaded only once
+_worker_extractor: typing.Optional[Extractor] = None
+# word -> embedding, shared by the batches of this worker
+_worker_word_embeddings: typing.Dict[str, typing.Any] = dict()
+
+
+def _init_worker(config: ExtractConfig):
+    global _worker_extractor
+    _worker_extractor = Extractor(config)
+
+
+def _extract_tokens_in_worker(batch: typing.List[str]) -> typing.List[typing.Set[str]]:
+    return _worker_extractor._extract_tokens_from_batch(batch, _worker_word_embeddings)
@@ -0,0 +1,379 @@
+import codecs
+import os
+import re
+import subprocess
+import threading
+import typing
+from array import array
+
+import git
+from loguru import logger
+
+# `git log --format` of each commit: \0\0<sha>\0<message>\0
+# git never writes NUL into a commit message, and paths (-z) are never empty,
+# so two NULs followed by a sha can only be the start of a commit
+_LOG_FORMAT = "%x00%x00%H%x00%B%x00"
+_RECORD_START = re.compile("\0\0(?=[0-9a-f]{40,64}\0)")
+# fewer targets than this are passed to git as pathspec,
+# so git skips the other commits instead of listing their files
+_PATHSPEC_LIMIT = 256
+
+
+class CommitTable(object):
+    """
+    Interned commits, one entry for each sha.
+    Files refer to commits by their int ids, so no commit objects will be kept.
+    """
+
+    __slots__ = ("_shas", "_messages", "_ids")
+
+    def __init__(self):
+        self._shas: typing.List[str] = []
+        self._messages: typing.List[str] = []
+        self._ids: typing.Dict[str, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self._shas)
+
+    def add(self, sha: str, message: str) -> int:
+        commit_id = self._ids.get(sha)
+        if commit_id is None:
+            commit_id = len(self._shas)
+            self._ids[sha] = commit_id
+            self._shas.append(sha)
+            self._messages.append(message)
+        return commit_id
+
+    def sha(self, commit_id: int) -> str:
+        return self._shas[commit_id]
+
+    def message(self, commit_id: int) -> str:
+        return self._messages[commit_id]
+
+
+class CommitIndex(object):
+    """
+    path -> related commits, built from one single `git log` walk.
+
+    It works like running `repo.iter_commits(paths=each, max_count=...)` for every path,
+    but the history will be walked only once.
+    """
+
+    def __init__(
+            self,
+            repo: git.Repo,
+            max_count: int = -1,
+            commit_regex: typing.Optional[typing.Pattern] = None,
+            renames: typing.Optional[typing.Dict[str, typing.List[typing.List[str]]]] = None,
+    ):
+        self.repo = repo
+        self.max_count = max_count
+        self.commit_regex = commit_regex
+        # commit sha -> [old path, new path] of its renames, known from the cache
+        # renames will be followed if given, see `_follow_renames`
+        self.renames = renames
+        # renames detected in `build`, should be saved for next run
+        self.new_renames: typing.Dict[str, typing.List[typing.List[str]]] = dict()
+        # started on the first commit which needs detection
+        self._rename_detector: typing.Optional[_RenameDetector] = None
+
+        self.table = CommitTable()
+        # path -> commit ids
+        self._commits: typing.Dict[str, typing.Sequence[int]] = dict()
+        # how many commits have been seen for each target, before regex filter
+        self._counter: typing.Dict[str, int] = dict()
+        # commits walked in `build`
+        self.scanned = 0
+
+    def get(self, path: str) -> typing.Sequence[int]:
+        return self._commits.get(path, array("L"))
+
+    def pop(self, path: str) -> typing.Sequence[int]:
+        return self._commits.pop(path, array("L"))
+
+    def build(
+            self,
+            file_paths: typing.Iterable[str] = (),
+            dir_paths: typing.Iterable[str] = (),
+    ):
+        files = set(file_paths)
+        dirs = set(dir_paths)
+        for each in files.union(dirs):
+            self._commits[each] = array("L")
+            self._counter[each] = 0
+        if not files and not dirs:
+            return
+
+        # old path -> targets, for the paths renamed to the targets (or files in them)
+        # history is walked backwards, so the new name is always seen first
+        lineage: typing.Dict[str, typing.Set[str]] = {each: {each} for each in files}
+
+        # without renames, only the commits touching the targets matter
+        # root dir means everything
+        pathspec = None
+        if self.renames is None and "" not in dirs and len(self._counter) <= _PATHSPEC_LIMIT:
+            pathspec = sorted(self._counter)
+
+        try:
+            self._walk(dirs, lineage, len(self._counter), pathspec)
+        finally:
+            if self._rename_detector is not None:
+                self._rename_detector.close()
+                self._rename_detector = None
+
+    def _walk(
+            self,
+            dirs: typing.Set[str],
+            lineage: typing.Dict[str, typing.Set[str]],
+            pending: int,
+            pathspec: typing.Optional[typing.List[str]] = None,
+    ):
+        total = 0
+        for sha, message, touched, added in self._iter_log(pathspec):
+            total += 1
+            targets = set()
+            for each_path in touched:
+                targets.update(lineage.get(each_path, ()))
+                if dirs:
+                    targets.update(self._match_dirs(each_path, dirs))
+            # root dir means the whole repo, like `iter_commits(paths="")`
+            if "" in dirs:
+                targets.add("")
+            if self.renames is not None and added:
+                self._follow_renames(sha, touched, added, dirs, lineage)
+
+            for each_target in targets:
+                if self._is_full(each_target):
+                    continue
+                self._counter[each_target] += 1
+                if self._is_full(each_target):
+                    pending -= 1
+
+                if self.commit_regex and not self.commit_regex.match(message):
+                    continue
+                self._commits[each_target].append(self.table.add(sha, message))
+
+            if not pending:
+                # all the targets got enough commits
+                break
+        self.scanned += total
+        logger.debug(f"history walk finished, commits: {total}, targets: {len(self._counter)}")
+
+    def _follow_renames(
+            self,
+            sha: str,
+            touched: typing.List[str],
+            added: typing.List[str],
+            dirs: typing.Set[str],
+            lineage: typing.Dict[str, typing.Set[str]],
+    ):
+        # older commits of the old path belong to the targets of the new one
+        related = [
+            each for each in added
+            if each in lineage or (dirs and any(self._match_dirs(each, dirs)))
+        ]
+        # only a commit adding a related path and deleting something can rename it
+        if not related or len(touched) == len(added):
+            return
+
+        renames = self.renames.get(sha)
+        if renames is None:
+            if self._rename_detector is None:
+                self._rename_detector = _RenameDetector(self.repo)
+            renames = self._rename_detector.detect(sha)
+            self.renames[sha] = renames
+            self.new_renames[sha] = renames
+
+        for old, new in renames:
+            targets = set(lineage.pop(new, ()))
+            if dirs:
+                targets.update(self._match_dirs(new, dirs))
+            if targets:
+                lineage.setdefault(old, set()).update(targets)
+
+    def _is_full(self, target: str) -> bool:
+        return self.max_count != -1 and self._counter[target] >= self.max_count
+
+    @staticmethod
+    def _match_dirs(path: str, dirs: typing.Set[str]) -> typing.Iterable[str]:
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            each_dir = "/".join(parts[:i])
+            if each_dir in dirs:
+                yield each_dir
+
+    def _iter_log(
+            self, pathspec: typing.Optional[typing.List[str]] = None
+    ) -> typing.Iterable[typing.Tuple[str, str, typing.List[str], typing.List[str]]]:
+        if not self.repo.head.is_valid():
+            # no commits yet
+            return
+
+        # --no-renames: a moved file touches both paths, same as rev-list with paths
+        # added paths are only needed for following renames
+        args = [
+            "--name-status" if self.renames is not None else "--name-only",
+            "--no-renames",
+            "-z",
+            f"--format={_LOG_FORMAT}",
+        ]
+        if self.renames is None:
+            # a merge touches the paths different from all its parents, same as rev-list with paths
+            # `git log --follow` never shows merges
+            args.append("-c")
+        if pathspec is not None:
+            # every commit touching any of them, the counting is still done per target
+            args += ["--full-history", "--"] + [f":(literal){each}" for each in pathspec]
+        proc = self.repo.git.log(*args, as_process=True)
+        # drained in background, git blocks on a full stderr pipe
+        stderr = []
+        stderr_reader = threading.Thread(
+            target=lambda: stderr.append(proc.proc.stderr.read()), daemon=True
+        )
+        stderr_reader.start()
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buf = ""
+        finished = False
+        try:
+            while True:
+                chunk = proc.stdout.read(1024 * 64)
+                if not chunk:
+                    break
+                buf += decoder.decode(chunk)
+                records = _RECORD_START.split(buf)
+                # last one may be incomplete
+                buf = records.pop()
+                for each in records:
+                    if each:
+                        yield self._parse_record(each)
+            finished = True
+        finally:
+            if not finished:
+                # generator may be closed early
+                proc.proc.kill()
+            status = proc.proc.wait()
+            stderr_reader.join()
+
+        # a broken walk should never be cached as empty histories
+        if status != 0:
+            raise git.GitCommandError(["git", "log", *args], status, b"".join(stderr))
+        if buf:
+            yield self._parse_record(buf)
+
+    def _parse_record(self, record: str) -> typing.Tuple[str, str, typing.List[str], typing.List[str]]:
+        sha, message, files = record.split("\0", 2)
+        parts = [each for each in files.lstrip("\0\n").split("\0") if each]
+        if self.renames is None:
+            return sha, message, parts, []
+
+        # <status>\0<path>\0 for each file
+        touched = parts[1::2]
+        added = [path for status, path in zip(parts[::2], touched) if status == "A"]
+        return sha, message, touched, added
+
+
+class _RenameDetector(object):
+    """
+    One `git diff-tree --stdin -M` process for all the commits needing rename detection,
+    instead of a process for each of them.
+
+    Non-commit lines are echoed back by git, so each answer ends with the marker.
+    """
+
+    _MARKER = b"\x1egfk-end\x1e\n"
+
+    def __init__(self, repo: git.Repo):
+        self._args = ["git", "diff-tree", "--stdin", "-M", "-r", "-z", "--name-status", "--no-commit-id"]
+        self._proc = repo.git.execute(self._args, as_process=True, istream=subprocess.PIPE)
+        self._closed = False
+
+    def detect(self, sha: str) -> typing.List[typing.List[str]]:
+        proc = self._proc.proc
+        proc.stdin.write(sha.encode("ascii") + b"\n" + self._MARKER)
+        proc.stdin.flush()
+
+        buf = b""
+        while not buf.endswith(self._MARKER):
+            chunk = os.read(proc.stdout.fileno(), 1024 * 64)
+            if not chunk:
+                self._raise()
+            buf += chunk
+        output = buf[: -len(self._MARKER)].decode("utf-8", errors="replace")
+
+        parts = [each for each in output.split("\0") if each]
+        ret = []
+        i = 0
+        while i < len(parts):
+            status = parts[i].strip("\n")
+            if status.startswith(("R", "C")):
+                if status.startswith("R"):
+                    ret.append([parts[i + 1], parts[i + 2]])
+                i += 3
+            else:
+                i += 2
+        return ret
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        proc = self._proc.proc
+        proc.stdin.close()
+        if proc.wait():
+            self._raise()
+
+    def _raise(self):
+        self._closed = True
+        proc = self._proc.proc
+        proc.kill()
+        status = proc.wait()
+        raise git.GitCommandError(self._args, status, proc.stderr.read())
+
+
+def diff_paths(repo: git.Repo, since: str) -> typing.Optional[typing.Set[str]]:
+    """
+    paths touched after commit `since`, including uncommitted changes.
+    None if the history has been rewritten and `since` is no longer an ancestor.
+    """
+    try:
+        if not repo.is_ancestor(since, repo.head.commit.hexsha):
+            return None
+    except git.GitCommandError:
+        # unknown commit
+        return None
+
+    ret = set()
+    # every commit after `since`, even if the change has been reverted
+    committed = repo.git.log(
+        "--name-only", "--no-renames", "-z", "--format=", f"{since}..HEAD"
+    )
+    # working tree (and index) against `since`
+    uncommitted = repo.git.diff("--name-only", "--no-renames", "-z", since)
+    for each in (committed + "\0" + uncommitted).split("\0"):
+        each = each.strip("\n")
+        if each:
+            ret.add(each)
+    return ret
+
+
+def list_tracked_files(repo: git.Repo) -> typing.List[str]:
+    """
+    regular files in git index, without touching the files in python.
+    submodules, symlinks, deleted (not staged yet) files
+    and skip-worktree files (not checked out in sparse checkout) are excluded.
+    symlinks to files were kept when the work tree was globbed, not any more.
+    """
+    deleted = set(repo.git.ls_files("-z", "--deleted").split("\0"))
+    ret = dict()
+    for each in repo.git.ls_files("-z", "-t", "--stage").split("\0"):
+        if not each:
+            continue
+        # <tag> <mode> <sha> <stage>\t<path>
+        info, path = each.split("\t", 1)
+        tag, mode = info.split(" ", 2)[:2]
+        if tag == "S" or mode in ("160000", "120000") or path in deleted:
+            continue
+        # conflicted files have several stages
+        ret[path] = None
+    return list(ret)
@@ -0,0 +1,225 @@
+import asyncio
+import email.utils
+import json
+import random
+import time
+import typing
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+# retry these http status
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+# tiktoken encoding, False if tiktoken is not installed
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    # rough estimation, ~4 chars per token for english
+    # but a non-ascii char (e.g. cjk) takes one token at least
+    non_ascii = sum(1 for each in text if ord(each) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def count_tokens(text: str) -> int:
+    # exact count with tiktoken if installed, otherwise estimated
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # not installed, or the encoding file can not be downloaded
+            logger.debug(f"tiktoken not available, token count will be estimated: {e}")
+            _encoding = False
+    if _encoding is False:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class TokenBucket(object):
+    """
+    `rate` per minute, 0 means unlimited.
+
+    It holds one second of rate only, so requests are paced from the start
+    instead of bursting a whole minute of quota.
+    A request larger than that goes into debt, which later requests pay back.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate / 60, 1)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate / 60)
+        self._last = now
+
+    async def acquire(self, amount: float = 1):
+        if not self.rate:
+            return
+        async with self._lock:
+            self._refill()
+            # a single large request should not wait forever
+            need = min(amount, self.capacity)
+            while self._tokens < need:
+                await asyncio.sleep((need - self._tokens) * 60 / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+
+class LLMRequestError(Exception):
+    def __init__(self, msg: str, status: int = 0, retry_after: typing.Optional[float] = None):
+        super().__init__(msg)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AsyncChatClient(object):
+    """
+    Client of any OpenAI-compatible `/chat/completions` endpoint.
+    Requests are sent concurrently, limited by rpm/tpm, and retried with backoff.
+    """
+
+    def __init__(
+            self,
+            api_base: str,
+            model: str,
+            api_key: str = "",
+            concurrency: int = 4,
+            rpm: float = 0,
+            tpm: float = 0,
+            max_retries: int = 5,
+            timeout: float = 120,
+    ):
+        self.api_base = api_base.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.concurrency = max(concurrency, 1)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    def chat_many(
+            self,
+            requests: typing.List[typing.List[dict]],
+            on_response: typing.Optional[typing.Callable[[int, str], None]] = None,
+    ) -> typing.List[typing.Optional[str]]:
+        # messages list -> response content, None if failed
+        # `on_response(index, content)` is called as soon as each one arrives,
+        # so answers are kept even if the others fail
+        if not requests:
+            return []
+        return asyncio.run(self._chat_many(requests, on_response))
+
+    async def _chat_many(
+            self,
+            requests: typing.List[typing.List[dict]],
+            on_response: typing.Optional[typing.Callable[[int, str], None]] = None,
+    ) -> typing.List[typing.Optional[str]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        request_bucket = TokenBucket(self.rpm)
+        token_bucket = TokenBucket(self.tpm)
+        finished = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            async def _run(index: int, messages: typing.List[dict]) -> typing.Optional[str]:
+                nonlocal finished
+                async with semaphore:
+                    try:
+                        content = await self._chat(
+                            executor, request_bucket, token_bucket, messages
+                        )
+                    except Exception as e:
+                        # one failed request should never drop the others
+                        logger.warning(f"llm request failed: {e!r}")
+                        return None
+                    finally:
+                        finished += 1
+                        logger.info(f"{finished}/{len(requests)} llm requests finished")
+
+                if on_response is not None:
+                    try:
+                        on_response(index, content)
+                    except Exception as e:
+                        logger.warning(f"llm response handler failed: {e!r}")
+                return content
+
+            responses = await asyncio.gather(
+                *[_run(i, each) for i, each in enumerate(requests)], return_exceptions=True
+            )
+            return [None if isinstance(each, BaseException) else each for each in responses]
+
+    async def _chat(
+            self,
+            executor: ThreadPoolExecutor,
+            request_bucket: TokenBucket,
+            token_bucket: TokenBucket,
+            messages: typing.List[dict],
+    ) -> str:
+        cost = sum(count_tokens(each["content"]) for each in messages)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await request_bucket.acquire()
+            await token_bucket.acquire(cost)
+            try:
+                return await loop.run_in_executor(executor, self._post, messages)
+            except LLMRequestError as e:
+                if attempt == self.max_retries or (e.status and e.status not in RETRY_STATUS):
+                    raise
+                wait = e.retry_after
+                if wait is None:
+                    wait = min(2 ** attempt, 60) + random.random()
+                logger.info(f"llm request retry after {wait:.1f}s, reason: {e}")
+                await asyncio.sleep(wait)
+
+    def _post(self, messages: typing.List[dict]) -> str:
+        body = json.dumps({"model": self.model, "messages": messages}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        req = urllib.request.Request(
+            f"{self.api_base}/chat/completions", data=body, headers=headers, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise LLMRequestError(
+                f"http {e.code}: {e.read()[:200]!r}",
+                status=e.code,
+                retry_after=_parse_retry_after(e.headers.get("Retry-After")),
+            ) from e
+        except Exception as e:
+            # network errors (`socket.timeout` is not a `TimeoutError` before 3.10),
+            # or a broken body, e.g. an html page from a proxy. retry
+            raise LLMRequestError(repr(e)) from e
+
+        try:
+            return data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise LLMRequestError(f"unexpected response: {str(data)[:200]}", status=-1) from e
+
+
+def _parse_retry_after(value: typing.Optional[str]) -> typing.Optional[float]:
+    # seconds, or a http date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,98 @@
+import contextlib
+import json
+import time
+import typing
+
+from pydantic import BaseModel
+
+# counter pairs reported as hit ratio, name -> (hit, miss)
+RATIOS = {
+    "file_cache": ("files_cached", "files_todo"),
+    "commit_token_cache": ("commit_tokens_cached", "commits_new"),
+    "segment_cache": ("segment_cache_hits", "segment_cache_misses"),
+    "llm_description_cache": ("llm_description_cache_hits", "llm_description_cache_misses"),
+}
+
+
+class Metrics(BaseModel):
+    """
+    timers and counters of one run, see `Result.metrics`.
+
+    stages: verify, cache_read, checksum, history_walk, model_load, keyword_extraction,
+    tokenization, aggregation, cache_write, and `plugin:<id>` for each plugin.
+    """
+
+    # name -> seconds
+    timers: typing.Dict[str, float] = dict()
+    # name -> times
+    calls: typing.Dict[str, int] = dict()
+    counters: typing.Dict[str, float] = dict()
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def incr(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def ratios(self) -> typing.Dict[str, float]:
+        ret = dict()
+        for name, (hit, miss) in RATIOS.items():
+            hit = self.counters.get(hit, 0)
+            total = hit + self.counters.get(miss, 0)
+            if total:
+                ret[name] = hit / total
+        return ret
+
+    def report(self) -> dict:
+        return {
+            "timers": {
+                name: {"seconds": round(seconds, 6), "calls": self.calls.get(name, 0)}
+                for name, seconds in self.timers.items()
+            },
+            "counters": dict(self.counters),
+            "ratios": {name: round(value, 6) for name, value in self.ratios().items()},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2, ensure_ascii=False)
+
+    def to_prometheus(self, prefix: str = "gfk") -> str:
+        # text exposition format, e.g. for node_exporter textfile collector
+        lines = [
+            f"# TYPE {prefix}_stage_seconds gauge",
+            *[
+                f'{prefix}_stage_seconds{{stage="{name}"}} {seconds:.6f}'
+                for name, seconds in self.timers.items()
+            ],
+            f"# TYPE {prefix}_stage_calls gauge",
+            *[
+                f'{prefix}_stage_calls{{stage="{name}"}} {calls}'
+                for name, calls in self.calls.items()
+            ],
+            f"# TYPE {prefix}_counter gauge",
+            *[
+                f'{prefix}_counter{{name="{name}"}} {value:g}'
+                for name, value in self.counters.items()
+            ],
+            f"# TYPE {prefix}_cache_hit_ratio gauge",
+            *[
+                f'{prefix}_cache_hit_ratio{{cache="{name}"}} {value:.6f}'
+                for name, value in self.ratios().items()
+            ],
+        ]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        # prometheus text if `.prom`, otherwise json
+        data = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
@@ -0,0 +1,31 @@
+import threading
+import typing
+
+from loguru import logger
+
+# model name -> loaded keybert model, shared by all the extractors in this process
+_keybert_models: typing.Dict[str, typing.Any] = dict()
+_lock = threading.Lock()
+
+
+def load_keybert(model_name: str, shared: bool = True):
+    # loading a model takes seconds, do it only when there is something to extract
+    if not shared:
+        return _load_keybert(model_name)
+
+    with _lock:
+        if model_name not in _keybert_models:
+            _keybert_models[model_name] = _load_keybert(model_name)
+        return _keybert_models[model_name]
+
+
+def clear_models():
+    with _lock:
+        _keybert_models.clear()
+
+
+def _load_keybert(model_name: str):
+    from keybert import KeyBERT
+
+    logger.info(f"load keybert model: {model_name}")
+    return KeyBERT(model=model_name)
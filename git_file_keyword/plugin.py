@@ -1,11 +1,15 @@
-from collections import OrderedDict
+import math
+import pathlib
+import typing
+from collections import defaultdict
 
 from loguru import logger
-from sklearn.feature_extraction.text import TfidfVectorizer
 
 from git_file_keyword.config import ExtractConfig
 from git_file_keyword.result import Result
 
+TFIDF_PLUGIN_ID = "tf-idf"
+
 
 class BasePlugin(object):
     # modify in place
@@ -17,32 +21,108 @@ class BasePlugin(object):
 
 
 class TfidfPlugin(BasePlugin):
+    """
+    Same as `TfidfVectorizer` with default settings (smooth idf, l2 norm),
+    but the count matrix is built from `word_freq` directly.
+
+    Document frequencies of last run are kept in `Result.plugin_state` (and the cache).
+    They are counted from the rows again in each run and compared with the kept ones,
+    so only the changed files and the files with words whose df changed need rescoring.
+    A cache shared by concurrent runs does not keep them, all the files are rescored.
+    """
+
     def apply(self, config: ExtractConfig, result: Result):
         logger.info("calc tfidf ...")
-        # vocabulary
         documents = {
-            k: [word for word, freq in v.word_freq.items() for _ in range(freq)]
+            k: v.word_freq
             for k, v in result.file_results.items()
             if v.word_freq
         }
-        documents = OrderedDict(sorted(documents.items()))
 
-        # https://stackoverflow.com/a/63859161
-        vectorizer = TfidfVectorizer(analyzer=lambda x: x)
-        tfidf_matrix = vectorizer.fit_transform(documents.values())
-        feature_names = vectorizer.get_feature_names_out()
+        # never updated from the kept one, which can be stale
+        # e.g. rows written by a run without this plugin
+        state = self._gen_state(documents)
+        old_state = result.plugin_state.get(self.plugin_id())
+        targets = None
+        if old_state and old_state["n"] == state["n"]:
+            # idf only changes for the words whose df changed
+            old_df = old_state["df"]
+            changed_words = {
+                word for word, count in state["df"].items() if old_df.get(word) != count
+            }
+            targets = [
+                k for k, word_freq in documents.items()
+                if not result.file_results[k].cached
+                # scored by nobody, e.g. extracted without plugins
+                or self.plugin_id() not in result.file_results[k].plugin_output
+                or not changed_words.isdisjoint(word_freq)
+            ]
+        if targets is None:
+            # no state, or n changed, which means all the idf changed
+            targets = list(documents.keys())
+        result.plugin_state[self.plugin_id()] = state
+
+        logger.info(f"tfidf docs: {len(documents)}, rescore: {len(targets)}")
+        result.metrics.incr("tfidf_docs", len(documents))
+        result.metrics.incr("tfidf_rescored", len(targets))
+        if targets:
+            self._score(config, result, sorted(targets), state)
+
+    @staticmethod
+    def _gen_state(documents: typing.Dict[pathlib.Path, typing.Dict[str, int]]) -> dict:
+        df = defaultdict(int)
+        for word_freq in documents.values():
+            for word in word_freq:
+                df[word] += 1
+        return {"n": len(documents), "df": dict(df)}
+
+    def _score(
+            self,
+            config: ExtractConfig,
+            result: Result,
+            targets: typing.List[pathlib.Path],
+            state: dict,
+    ):
+        # heavy, imported only when something needs rescoring
+        import numpy as np
+        from scipy.sparse import csr_matrix
+        from sklearn.preprocessing import normalize
+
+        n = state["n"]
+        df = state["df"]
+        vocabulary: typing.Dict[str, int] = dict()
+        indptr = [0]
+        indices = []
+        data = []
+        for k in targets:
+            for word, freq in result.file_results[k].word_freq.items():
+                indices.append(vocabulary.setdefault(word, len(vocabulary)))
+                data.append(freq)
+            indptr.append(len(indices))
+        feature_names = list(vocabulary.keys())
+
+        # https://scikit-learn.org/stable/modules/feature_extraction.html#tfidf-term-weighting
+        idf = np.array([math.log((1 + n) / (1 + df[word])) + 1 for word in feature_names])
+        count_matrix = csr_matrix(
+            (np.array(data, dtype=np.float64), indices, indptr),
+            shape=(len(targets), len(feature_names)),
+        )
+        tfidf_matrix = normalize(count_matrix.multiply(idf).tocsr(), norm="l2")
 
-        for document_name, tfidf_vector in zip(documents.keys(), tfidf_matrix):
+        for document_name, tfidf_vector in zip(targets, tfidf_matrix):
             nonzero_indices = tfidf_vector.nonzero()[1]
             tfidf_scores = tfidf_vector.data
 
-            sorted_indices = tfidf_scores.argsort()[::-1][
-                             : config.max_tfidf_feature_length
-                             ]
+            # ties broken by word, word_freq order depends on how it was built
+            # rounded, the norm may differ in the last bit with another order
+            sorted_indices = sorted(
+                range(len(tfidf_scores)),
+                key=lambda i: (-round(tfidf_scores[i], 12), feature_names[nonzero_indices[i]]),
+            )[: config.max_tfidf_feature_length]
             cur_tfidf_dict = dict()
             for index in sorted_indices:
                 word = feature_names[nonzero_indices[index]]
-                score = tfidf_scores[index]
+                score = float(tfidf_scores[index])
                 cur_tfidf_dict[word] = score
 
             cur_file_result = result.file_results[document_name]
@@ -50,4 +130,4 @@ class TfidfPlugin(BasePlugin):
             cur_file_result.plugin_output[self.plugin_id()] = cur_tfidf_dict
 
     def plugin_id(self) -> str:
-        return "tf-idf"
+        return TFIDF_PLUGIN_ID
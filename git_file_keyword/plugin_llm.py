@@ -1,17 +1,17 @@
-import itertools
+import hashlib
+import json
 import pathlib
-import time
 import typing
+from collections import defaultdict
 
-import openai
-from bardapi import Bard
 from loguru import logger
 from pydantic import BaseModel
 
+from git_file_keyword.cache import create_cache_backend
 from git_file_keyword.config import ExtractConfig
+from git_file_keyword.llm_client import AsyncChatClient, count_tokens
 from git_file_keyword.plugin import BasePlugin
 from git_file_keyword.result import Result, FileResult
-from git_file_keyword.utils import split_list
 
 
 class Ask(BaseModel):
@@ -20,7 +20,11 @@ class Ask(BaseModel):
 
 
 class BaseLLMPlugin(BasePlugin):
-    # todo: LLM usage takes some money. Maybe the results should be cached.
+    model = ""
+    # token budget of keywords in each request, prompt excluded
+    max_request_tokens = 1500
+    # answers grow with files, keep them in the output limit
+    max_request_files = 30
     prompt = """
 Generate concise (<30 words) descriptions for each source file based on their associated keywords, 
 summarizing/guessing the function of each file. 
@@ -44,157 +48,259 @@ Sample Output:
     def plugin_id(self) -> str:
         return "llm"
 
-    def gen_ask_group(self, result: Result) -> typing.Dict[pathlib.Path, Ask]:
-        merged_dict: typing.Dict[pathlib.Path, typing.Dict[pathlib.Path, FileResult]] = {}
+    # LLM usage takes some money, so the descriptions are cached
+    # keyed by everything in the request, a file will be asked again only if its keywords changed
+    def description_key(self, file_path: pathlib.Path, file_result: FileResult) -> str:
+        data = [
+            self.plugin_id(),
+            self.model,
+            self.prompt,
+            file_path.as_posix(),
+            list(file_result.keywords),
+        ]
+        return hashlib.sha1(
+            json.dumps(data, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def read_description_cache(self, config: ExtractConfig, keys: typing.Iterable[str]) -> typing.Dict[str, str]:
+        backend = create_cache_backend(config)
+        try:
+            return backend.read_descriptions(keys)
+        finally:
+            backend.close()
+
+    def write_description_cache(self, config: ExtractConfig, descriptions: typing.Dict[str, str]):
+        if not descriptions:
+            return
+        # same backend as the file results, locked in sharded mode
+        backend = create_cache_backend(config)
+        try:
+            backend.write_descriptions(descriptions)
+        finally:
+            backend.close()
+
+    def apply_description_cache(
+            self, config: ExtractConfig, result: Result
+    ) -> typing.Dict[pathlib.Path, FileResult]:
+        # fill the cached descriptions, returns the files which should be asked
+        keys = {
+            file_path: self.description_key(file_path, file_result)
+            for file_path, file_result in result.file_results.items()
+        }
+        cache = self.read_description_cache(config, keys.values())
+        todo = dict()
         for file_path, file_result in result.file_results.items():
-            dir_path = file_path.parent
-            if dir_path not in merged_dict:
-                merged_dict[dir_path] = dict()
-            merged_dict[dir_path][file_path] = file_result
+            description = cache.get(keys[file_path])
+            if description is None:
+                todo[file_path] = file_result
+                continue
+            self._write_description(file_result, description)
+
+        logger.info(f"llm description cache hit: {len(result.file_results) - len(todo)}, "
+                    f"miss: {len(todo)}")
+        result.metrics.incr("llm_description_cache_hits", len(result.file_results) - len(todo))
+        result.metrics.incr("llm_description_cache_misses", len(todo))
+        return todo
+
+    def save_answers(
+            self,
+            config: ExtractConfig,
+            result: Result,
+            answer_dict: typing.Dict[pathlib.Path, str],
+    ):
+        # update to result and cache
+        descriptions = dict()
+        for each_path, each_desc in answer_dict.items():
+            if each_path not in result.file_results:
+                logger.warning(f"{each_path} not in result")
+                continue
 
+            file_result = result.file_results[each_path]
+            self._write_description(file_result, each_desc)
+            descriptions[self.description_key(each_path, file_result)] = each_desc
+        self.write_description_cache(config, descriptions)
+
+    def _write_description(self, file_result: FileResult, description: str):
+        file_result.description = description
+        file_result.plugin_output[self.plugin_id()] = description
+
+    def gen_ask_group(
+            self,
+            result: Result,
+            file_results: typing.Dict[pathlib.Path, FileResult] = None,
+    ) -> typing.Dict[pathlib.Path, Ask]:
+        if file_results is None:
+            file_results = result.file_results
+
+        # fill each request up to the token budget
+        # sorted, so files of the same dir are likely to be asked together
         ask_dict = dict()
-        for directory_path, group_dict in merged_dict.items():
-            # if the whole group does not contain any changes, ignore it
-            if all((each.cached for each in group_dict.values())):
-                continue
+        file_list: typing.List[pathlib.Path] = []
+        lines: typing.List[str] = []
+        used = 0
+
+        def _flush():
+            key = pathlib.Path(f"{file_list[0].parent.as_posix()}_{len(ask_dict) + 1}")
+            ask_dict[key] = Ask(file_list=list(file_list), request_txt="\n".join(lines))
+            file_list.clear()
+            lines.clear()
+
+        for file_path in sorted(file_results):
+            line = f"- {file_path.as_posix()}: {list(file_results[file_path].keywords)}"
+            # with the line break
+            cost = count_tokens(line) + 1
+            if file_list and (
+                    used + cost > self.max_request_tokens
+                    or len(file_list) >= self.max_request_files
+            ):
+                _flush()
+                used = 0
+            file_list.append(file_path)
+            lines.append(line)
+            used += cost
+        if file_list:
+            _flush()
+
+        logger.info(f"{len(file_results)} files packed into {len(ask_dict)} llm requests")
+        return ask_dict
 
-            logger.info(f"prepare llm response for {directory_path}")
-            # send the group to AI
-            if len(group_dict) < 10:
-                lines = [
-                    f"- {filepath}: {list(result.keywords)}"
-                    for filepath, result in group_dict.items()
-                ]
-                request_txt = "\n".join(lines)
-                ask_dict[directory_path] = Ask(
-                    file_list=list(group_dict.keys()), request_txt=request_txt
-                )
+    def parse_response(self, ask: Ask, responses: str) -> typing.Dict[pathlib.Path, str]:
+        # response lines -> path and description
+        full_paths = {each.as_posix(): each for each in ask.file_list}
+        names = defaultdict(list)
+        for each in ask.file_list:
+            names[each.name].append(each)
+
+        ret = dict()
+        for line in responses.split("\n"):
+            line = line.strip()
+            if not line.startswith("-") or ": " not in line:
+                continue
+            file_path, description = line.split(": ", 1)
+            file_path = file_path.lstrip("- ").strip("`*'\" ")
+
+            if file_path in full_paths:
+                ret[full_paths[file_path]] = description.strip()
+            # model sometimes returns the name only
+            # fix it only if the name is unique in this request
+            elif len(names.get(file_path, [])) == 1:
+                ret[names[file_path][0]] = description.strip()
             else:
-                # split into multi parts
-                chunks = list(split_list(list(group_dict.items()), 10))
-                for i, chunk in enumerate(chunks, start=1):
-                    lines = [
-                        f"- {filepath}: {list(result.keywords)}"
-                        for filepath, result in chunk
-                    ]
-                    request_txt = "\n".join(lines)
-
-                    ask_dict[pathlib.Path(f"{directory_path.as_posix()}_{i}")] = Ask(
-                        file_list=[filepath for filepath, _ in chunk],
-                        request_txt=request_txt,
-                    )
-        return ask_dict
+                logger.warning(f"can not map llm response to a file: {file_path}")
+        return ret
 
 
 class BardLLMPlugin(BaseLLMPlugin):
     # todo: current bard model looks too bad to use ...
     #  and there is no official sdk
     token = ""
-    proxies = {
-        "http": "http://127.0.0.1:7890",
-    }
+    # e.g. {"http": "http://127.0.0.1:7890"}
+    proxies: typing.Optional[dict] = None
 
     def __init__(self):
-        self.bard = Bard(
-            token=self.token,
-            proxies=self.proxies,
-        )
+        self._bard = None
+
+    @property
+    def bard(self):
+        # connect on the first request, nothing happens if everything is cached
+        if self._bard is None:
+            from bardapi import Bard
+
+            self._bard = Bard(
+                token=self.token,
+                proxies=self.proxies,
+            )
+        return self._bard
 
     def plugin_id(self) -> str:
         return "llm-bard"
 
     def apply(self, config: ExtractConfig, result: Result):
-        ask_dict = self.gen_ask_group(result)
+        ask_dict = self.gen_ask_group(result, self.apply_description_cache(config, result))
         answer_dict = dict()
 
+        result.metrics.incr("llm_requests", len(ask_dict))
         for each_dir, each_ask in ask_dict.items():
             resp = self.bard.get_answer(f"{self.prompt}\n{each_ask.request_txt}")
-            responses = resp["content"]
-
-            valid_lines = [
-                each for each in responses.split("\n") if each.startswith("-")
-            ]
-            for line in valid_lines:
-                file_path, description = line.split(": ", 1)
-                file_path = file_path.lstrip("- ")
-
-                # fix this file_path
-                # model sometimes returns the name only
-                for each_valid_file_path in each_ask["file_list"]:
-                    if file_path == each_valid_file_path.name:
-                        file_path = each_valid_file_path
-                        break
-                else:
-                    # maybe it's correct ...
-                    file_path = pathlib.Path(file_path)
-
-                answer_dict[file_path] = description
-
-        # update to result
-        for each_path, each_desc in answer_dict.items():
-            if each_path not in result.file_results:
-                logger.warning(f"{each_path} not in result")
-                continue
+            answer_dict.update(self.parse_response(each_ask, resp["content"]))
 
-            result.file_results[each_path].plugin_output[self.plugin_id()] = each_desc
+        self.save_answers(config, result, answer_dict)
 
 
 class OpenAILLMPlugin(BaseLLMPlugin):
     token = ""
     model = "gpt-3.5-turbo"
+    api_base = "https://api.openai.com/v1"
+
+    # by default, trial api key rate limit: 3/min
+    # means 20s / request
     rate_limit_wait = 20
+    # requests / tokens per minute, 0 means unlimited
+    # rpm will be calculated from `rate_limit_wait` if None
+    rpm: typing.Optional[float] = None
+    tpm: float = 0
+    concurrency = 4
+    max_retries = 5
 
     def plugin_id(self) -> str:
         return "llm-openai"
 
+    def create_client(self) -> AsyncChatClient:
+        rpm = self.rpm
+        if rpm is None:
+            rpm = 60 / self.rate_limit_wait if self.rate_limit_wait else 0
+        return AsyncChatClient(
+            api_base=self.api_base,
+            model=self.model,
+            api_key=self.token,
+            concurrency=self.concurrency,
+            rpm=rpm,
+            tpm=self.tpm,
+            max_retries=self.max_retries,
+        )
+
     def apply(self, config: ExtractConfig, result: Result):
-        ask_dict = self.gen_ask_group(result)
-        answer_dict = dict()
-        openai.api_key = self.token
+        ask_dict = self.gen_ask_group(result, self.apply_description_cache(config, result))
 
         logger.info(f"total llm requests to go: {len(ask_dict)}")
-        for cur, (each_dir, each_ask) in enumerate(ask_dict.items()):
-            completion = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
+        ask_list = list(ask_dict.values())
+
+        def _on_response(index: int, responses: str):
+            # saved as soon as it arrives, it has been paid
+            logger.debug(f"llm resp: {responses}")
+            answers = self.parse_response(ask_list[index], responses)
+            self.save_answers(config, result, answers)
+
+        responses_list = self.create_client().chat_many(
+            [
+                [
                     {
                         "role": "system",
                         "content": self.prompt,
                     },
                     {"role": "user", "content": each_ask.request_txt},
-                ],
-            )
-            responses: str = completion.choices[0].message.content
-
-            valid_lines = [
-                each for each in responses.split("\n") if each.startswith("-")
-            ]
-            for line in valid_lines:
-                file_path, description = line.split(": ", 1)
-                file_path = file_path.lstrip("- ")
-
-                # fix this file_path
-                # model sometimes returns the name only
-                for each_valid_file_path in each_ask.file_list:
-                    if file_path == each_valid_file_path.name:
-                        file_path = each_valid_file_path
-                        break
-                else:
-                    # maybe it's correct ...
-                    file_path = pathlib.Path(file_path)
-
-                answer_dict[file_path] = description
-
-            # by default, trial api key rate limit: 3/min
-            # means 20s / request
-            logger.info(f"{cur + 1}/{len(ask_dict)} finished, resp: {responses}")
-            time.sleep(self.rate_limit_wait)
-
-        # update to result
-        for each_path, each_desc in answer_dict.items():
-            if each_path not in result.file_results:
-                logger.warning(f"{each_path} not in result")
-                continue
+                ]
+                for each_ask in ask_list
+            ],
+            on_response=_on_response,
+        )
+
+        result.metrics.incr("llm_requests", len(ask_list))
+        result.metrics.incr("llm_requests_failed", sum(1 for each in responses_list if each is None))
 
-            result.file_results[each_path].description = each_desc
-            result.file_results[each_path].plugin_output[self.plugin_id()] = each_desc
+
+class LocalLLMPlugin(OpenAILLMPlugin):
+    """
+    Any OpenAI-compatible server in local network, e.g. llama.cpp server, vLLM.
+    No key and no rate limit, requests are sent in parallel and batched by the server.
+    """
+
+    model = "local"
+    api_base = "http://127.0.0.1:8080/v1"
+    rpm = 0
+    tpm = 0
+    # should match the parallel slots of the server
+    concurrency = 8
+
+    def plugin_id(self) -> str:
+        return "llm-local"
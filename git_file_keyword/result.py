@@ -1,20 +1,25 @@
 import csv
+import os
 import pathlib
 import typing
 from collections import defaultdict
 
-from git import Commit
 from pydantic import BaseModel
 
+from git_file_keyword.metrics import Metrics
+
 
 class FileResult(BaseModel):
     path: str = ""
     checksum: str = ""
     cached: bool = False
+    # `ExtractConfig.fingerprint` of word_freq, renewed if config changes
+    fingerprint: str = ""
 
     # raw
     word_freq: typing.Dict[str, int] = dict()
-    _commits: typing.List[Commit] = []
+    # ids in `Result._commit_table`
+    _commits: typing.Sequence[int] = []
 
     # final result
     keywords: typing.List[str] = list()
@@ -23,21 +28,40 @@ class FileResult(BaseModel):
     # plugin output
     plugin_output: typing.Dict = dict()
 
-    class Config:
-        arbitrary_types_allowed = True
+
+class CommitResult(BaseModel):
+    sha: str = ""
+    # keybert config, see `ExtractConfig.keybert_fingerprint`
+    fingerprint: str = ""
+    tokens: typing.List[str] = list()
+
+
+class KeywordHit(BaseModel):
+    path: str = ""
+    # sum of tf-idf scores of the matched words
+    score: float = 0.0
+    # sum of word_freq of the matched words
+    freq: int = 0
 
 
 class Result(BaseModel):
     file_results: typing.Dict[pathlib.Path, FileResult] = defaultdict(FileResult)
+    # plugin id -> anything (json serializable) plugins want to keep across runs
+    plugin_state: typing.Dict[str, typing.Any] = dict()
+    # timers and counters of the last run
+    metrics: Metrics = Metrics()
+
+    # old results of the files renewed in current run
+    # plugins can use them to update their state incrementally
+    _renewed: typing.Dict[pathlib.Path, FileResult] = dict()
+    # `history.CommitTable` of current run, sha and message of `FileResult._commits`
+    _commit_table: typing.Any = None
 
     def export_csv(self, path: str):
-        with open(path, "w", newline="", encoding="utf-8-sig") as csvfile:
-            writer = csv.writer(csvfile)
+        export_csv(self.file_results.values(), path)
 
-            # header
-            writer.writerow(["File", "Keywords", "Description"])
-            for k, v in self.file_results.items():
-                writer.writerow([k, "|".join(v.keywords), v.description or "N/A"])
+    def export_jsonl(self, path: str):
+        export_jsonl(self.file_results.values(), path)
 
     def export_global_word_freq(self) -> dict:
         merged_freq = dict()
@@ -45,3 +69,25 @@ class Result(BaseModel):
             for word, count in v.word_freq.items():
                 merged_freq[word] = merged_freq.get(word, 0) + count
         return merged_freq
+
+
+# exporters accept any iterable, e.g. `Extractor.extract_iter()`
+# each row will be written as soon as it comes
+
+
+def export_csv(file_results: typing.Iterable[FileResult], path: str):
+    with open(path, "w", newline="", encoding="utf-8-sig") as csvfile:
+        writer = csv.writer(csvfile)
+
+        # header
+        writer.writerow(["File", "Keywords", "Description"])
+        for each in file_results:
+            writer.writerow([each.path, "|".join(each.keywords), each.description or "N/A"])
+            csvfile.flush()
+
+
+def export_jsonl(file_results: typing.Iterable[FileResult], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for each in file_results:
+            f.write(each.model_dump_json(exclude={"cached", "fingerprint"}) + os.linesep)
+            f.flush()
@@ -0,0 +1,170 @@
+import json
+import pathlib
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+
+from git_file_keyword.extractor import Extractor
+from git_file_keyword.result import Result, FileResult
+
+
+class KeywordService(object):
+    """
+    Keep an extractor (and its model, cache and results) in memory,
+    so refresh only pays for the changed files, and query pays nothing.
+    """
+
+    def __init__(self, extractor: Extractor):
+        self.extractor = extractor
+        self.extractor.keep_in_memory = True
+
+        self.result = Result()
+        # refresh one by one, queries read the last finished result
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self) -> dict:
+        with self._refresh_lock:
+            start = time.time()
+            config = self.extractor.config
+            # files may be added or removed since last refresh
+            # empty list means all the files matching `config.include`
+            config.file_list = []
+
+            result = Result()
+            renewed = 0
+            for each in self.extractor.extract_iter(result):
+                if not each.cached:
+                    renewed += 1
+            self.result = result
+
+            ret = {
+                "files": len(config.file_list),
+                "renewed": renewed,
+                "elapsed": round(time.time() - start, 3),
+                "metrics": result.metrics.report(),
+            }
+            logger.info(f"refresh finished: {ret['files']} files, {ret['renewed']} renewed")
+            return ret
+
+    def keywords(self, paths: typing.Iterable[str]) -> typing.Dict[str, typing.Optional[dict]]:
+        # path -> keywords and description, None if unknown
+        file_results = self.result.file_results
+        ret = dict()
+        for each in paths:
+            file_result = file_results.get(self._to_key(each))
+            ret[each] = self._dump(file_result) if file_result else None
+        return ret
+
+    def query(self, words: typing.Iterable[str], limit: int = 20) -> typing.List[dict]:
+        # cache connection is shared with refresh, and in sync after it
+        with self._refresh_lock:
+            return [each.model_dump() for each in self.extractor.query_keyword(words, limit)]
+
+    def _to_key(self, path: str) -> pathlib.Path:
+        # keys are relative paths, but editors usually send the absolute one
+        path = pathlib.Path(path)
+        if path.is_absolute():
+            try:
+                path = path.relative_to(self.extractor.config.repo_root)
+            except ValueError:
+                pass
+        return path
+
+    @staticmethod
+    def _dump(file_result: FileResult) -> dict:
+        return {
+            "keywords": file_result.keywords,
+            "description": file_result.description,
+        }
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # set by `create_server`
+    service: KeywordService = None
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def _handle(self, method: typing.Callable[[typing.Any], typing.Tuple[int, typing.Any]]):
+        # always reply, an exception would drop the connection silently
+        try:
+            status, data = method(urlparse(self.path))
+        except _BadRequest as e:
+            status, data = 400, {"error": str(e)}
+        except Exception as e:
+            logger.exception(f"request failed: {self.path}")
+            status, data = 500, {"error": repr(e)}
+        self._reply(status, data)
+
+    def _get(self, url) -> typing.Tuple[int, typing.Any]:
+        query = parse_qs(url.query)
+        if url.path == "/keywords":
+            return 200, self.service.keywords(query.get("path", []))
+        if url.path == "/query":
+            try:
+                limit = int(query.get("limit", ["20"])[0])
+            except ValueError:
+                raise _BadRequest("limit should be an int")
+            return 200, self.service.query(query.get("word", []), limit)
+        if url.path == "/refresh":
+            # changes the state, POST only
+            return 405, {"error": "use POST /refresh"}
+        if url.path == "/health":
+            return 200, {"files": len(self.service.result.file_results)}
+        return 404, {"error": f"unknown path: {url.path}"}
+
+    def _post(self, url) -> typing.Tuple[int, typing.Any]:
+        if url.path == "/refresh":
+            return 200, self.service.refresh()
+        if url.path == "/keywords":
+            # {"paths": [...]}, for long lists
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                raise _BadRequest("body should be json like {\"paths\": [...]}")
+            paths = body.get("paths", []) if isinstance(body, dict) else None
+            if not isinstance(paths, list) or not all(isinstance(each, str) for each in paths):
+                raise _BadRequest("paths should be a list of str")
+            return 200, self.service.keywords(paths)
+        return 404, {"error": f"unknown path: {url.path}"}
+
+    def _reply(self, status: int, data: typing.Any):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def create_server(service: KeywordService, host: str = "127.0.0.1", port: int = 7272) -> ThreadingHTTPServer:
+    handler = type("Handler", (_Handler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(service: KeywordService, host: str = "127.0.0.1", port: int = 7272):
+    # warm up, so the first query gets the answer
+    service.refresh()
+    server = create_server(service, host, port)
+    logger.info(f"gfk server is running on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import pathlib
+import time
+import typing
+from collections import OrderedDict
+
+from loguru import logger
+
+
+# https://maartengr.github.io/KeyBERT/faq.html#how-can-i-use-keybert-with-chinese-documents
+def tokenize_zh(text: str) -> typing.List[str]:
+    import rjieba as jieba
+
+    return jieba.cut(text)
+
+
+class CachedTokenizer(object):
+    """
+    `tokenize_zh` memoised by the hash of text, with LRU eviction.
+
+    A doc will be segmented several times in one run (keybert fits and transforms it),
+    and the same messages come again in long-running process.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # spent in segmentation
+        self.seconds = 0.0
+        # hash of text -> tokens, text itself is not kept
+        self._cache: typing.OrderedDict[bytes, typing.List[str]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __call__(self, text: str) -> typing.List[str]:
+        key = self._key(text)
+        tokens = self._cache.get(key)
+        if tokens is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return tokens
+
+        self.misses += 1
+        start = time.perf_counter()
+        tokens = tokenize_zh(text)
+        self.seconds += time.perf_counter() - start
+        self._put(key, tokens)
+        return tokens
+
+    def load(self, path: pathlib.Path):
+        if not path.is_file():
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                each = json.loads(line)
+                self._put(bytes.fromhex(each["key"]), each["tokens"])
+        logger.debug(f"load {len(self)} segments from {path}")
+
+    def save(self, path: pathlib.Path):
+        # least recently used first, so the order survives a reload
+        with open(path, "w", encoding="utf-8") as f:
+            for key, tokens in self._cache.items():
+                line = json.dumps({"key": key.hex(), "tokens": tokens}, ensure_ascii=False)
+                f.write(line + os.linesep)
+
+    def _put(self, key: bytes, tokens: typing.List[str]):
+        self._cache[key] = tokens
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
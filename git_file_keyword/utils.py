@@ -1,8 +1,11 @@
 import hashlib
 import pathlib
 import re
+import typing
 from collections import defaultdict
 
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
 
 def merge_word_freq(dict1, dict2):
     merged_dict = defaultdict(int)
@@ -13,10 +16,26 @@ def merge_word_freq(dict1, dict2):
     return merged_dict
 
 
-def calc_checksum(fp: pathlib.Path):
+def calc_checksum(fp: pathlib.Path, index_entry=None, index_mtime: float = 0.0) -> str:
+    # same as `git hash-object`, so it can be compared with the blob sha in git index
+    stat = fp.stat()
+
+    # if the file looks untouched since it was staged, trust the sha in git index
+    # like git itself, skip it when the file was modified after the index (racy git)
+    if index_entry is not None and stat.st_size == index_entry.size:
+        mtime_sec, mtime_nsec = index_entry.mtime
+        if (
+                mtime_sec == int(stat.st_mtime)
+                and (not mtime_nsec or mtime_nsec == stat.st_mtime_ns % 1_000_000_000)
+                and stat.st_mtime < index_mtime
+        ):
+            return index_entry.hexsha
+
+    hasher = hashlib.sha1(f"blob {stat.st_size}\0".encode())
     with fp.open(mode="rb") as f:
-        hasher = hashlib.new("sha1", f.read())
-        return hasher.hexdigest()
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
 
 def strip_symbol(origin: str) -> str:
@@ -26,3 +45,61 @@ def strip_symbol(origin: str) -> str:
 def split_list(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i : i + n]
+
+
+def glob_to_regex(pattern: str) -> typing.Pattern:
+    """
+    match posix relative paths like `glob.glob(pattern, recursive=True)`, without touching fs.
+    `**` matches any dirs, `*` and `?` never match `/`,
+    and hidden names are matched only if the pattern part starts with `.`.
+    `.` parts (e.g. `./src/**`) are dropped, paths in git index are always normalized.
+    """
+    parts = [each for each in pattern.strip("/").split("/") if each and each != "."]
+    regex = ""
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == "**":
+            regex += r"(?:(?!\.)[^/]+/)*"
+            if last:
+                regex += r"(?!\.)[^/]+"
+            continue
+
+        if not part.startswith("."):
+            regex += r"(?!\.)"
+        regex += _translate_glob_part(part)
+        if not last:
+            regex += "/"
+    return re.compile(regex + r"\Z")
+
+
+def _translate_glob_part(part: str) -> str:
+    ret = ""
+    i = 0
+    while i < len(part):
+        c = part[i]
+        i += 1
+        if c == "*":
+            ret += "[^/]*"
+        elif c == "?":
+            ret += "[^/]"
+        elif c == "[":
+            end = part.find("]", i + 1 if part[i:i + 1] in ("!", "]") else i)
+            if end == -1:
+                ret += re.escape(c)
+                continue
+            chars = part[i:end]
+            i = end + 1
+            negative = chars.startswith("!")
+            if negative:
+                chars = chars[1:]
+            # literal in glob, but special in a regex set (nested set, set operations)
+            chars = re.sub(r"([\\\[&~|])", r"\\\1", chars)
+            if chars.startswith("^"):
+                chars = "\\" + chars
+            if negative:
+                # never match the separator, like a part of glob
+                chars = "^/" + chars
+            ret += "[" + chars + "]"
+        else:
+            ret += re.escape(c)
+    return ret
@@ -36,7 +36,10 @@ setup(
         "rjieba>=0.1.11",
         # llm
         "bardapi>=0.1.33",
-        "openai>=0.28.0",
     ],
+    extras_require={
+        # exact token count for llm request packing and tpm limit
+        "llm": ["tiktoken>=0.5.1"],
+    },
     entry_points={"console_scripts": ["gfk = git_file_keyword.cli:main"]},
 )
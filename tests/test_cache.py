@@ -0,0 +1,60 @@
+import pytest
+
+from git_file_keyword.cache import JsonlCacheBackend, ShardedJsonlCacheBackend, SqliteCacheBackend
+from git_file_keyword.result import FileResult
+
+
+def test_sharded_keeps_rows_extracted_by_others(tmp_path):
+    ours = ShardedJsonlCacheBackend(tmp_path, shards=4)
+    ours.write([FileResult(path="a.py", checksum="1", word_freq={"old": 1})])
+    loaded = ours.load()
+
+    # another run extracts a.py again after we loaded it
+    other = ShardedJsonlCacheBackend(tmp_path, shards=4)
+    other.write([FileResult(path="a.py", checksum="2", word_freq={"new": 1})])
+
+    # only rescored here, the newer row wins
+    rescored = loaded[next(iter(loaded))].model_copy(update={"keywords": ["old"]})
+    ours.write([rescored, FileResult(path="b.py", checksum="1", word_freq={"b": 1})])
+    rows = ShardedJsonlCacheBackend(tmp_path, shards=4).load()
+    assert {each.path: each.checksum for each in rows.values()} == {"a.py": "2", "b.py": "1"}
+
+    # extracted again here, the latest one wins
+    ours.write([FileResult(path="a.py", checksum="3", word_freq={"newer": 1})])
+    assert ShardedJsonlCacheBackend(tmp_path, shards=4).get("a.py").checksum == "3"
+
+
+@pytest.mark.parametrize("backend_class", [JsonlCacheBackend, ShardedJsonlCacheBackend, SqliteCacheBackend])
+def test_descriptions(tmp_path, backend_class):
+    backend = backend_class(tmp_path)
+    backend.write_descriptions({"k1": "first", "k2": "second"})
+    backend.write_descriptions({"k1": "renewed"})
+    assert backend.read_descriptions(["k1", "k2", "k3"]) == {"k1": "renewed", "k2": "second"}
+    backend.close()
+
+    if backend_class is not SqliteCacheBackend:
+        # no duplicate keys pile up
+        assert len((tmp_path / "llm.txt").read_text().splitlines()) == 2
+
+
+def test_descriptions_imported_into_sqlite(tmp_path):
+    # kept in llm.txt by older versions
+    JsonlCacheBackend(tmp_path).write_descriptions({"k1": "paid"})
+    backend = SqliteCacheBackend(tmp_path)
+    assert backend.read_descriptions(["k1"]) == {"k1": "paid"}
+    backend.close()
+
+
+@pytest.mark.parametrize("backend_class", [JsonlCacheBackend, ShardedJsonlCacheBackend, SqliteCacheBackend])
+def test_commit_tokens_by_sha(tmp_path, backend_class):
+    backend = backend_class(tmp_path)
+    backend.write_commit_tokens("fp1", {f"{i:040x}": {f"w{i}"} for i in range(1200)})
+    backend.write_commit_tokens("fp2", {f"{1:040x}": {"other"}})
+
+    wanted = [f"{i:040x}" for i in (1, 2, 1100)] + ["f" * 40]
+    assert backend.read_commit_tokens("fp1", wanted) == {
+        f"{1:040x}": {"w1"}, f"{2:040x}": {"w2"}, f"{1100:040x}": {"w1100"},
+    }
+    assert backend.read_commit_tokens("fp2", wanted) == {f"{1:040x}": {"other"}}
+    assert backend.read_commit_tokens("fp1", []) == {}
+    backend.close()
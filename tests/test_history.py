@@ -0,0 +1,141 @@
+import pathlib
+import subprocess
+
+import git
+import pytest
+
+from git_file_keyword.history import CommitIndex
+
+
+def _git(repo: pathlib.Path, *args: str):
+    subprocess.check_call(["git", *args], cwd=repo, stdout=subprocess.DEVNULL)
+
+
+def _commit(repo: pathlib.Path, message: str, files: dict):
+    # files: path -> content, None to delete
+    for path, content in files.items():
+        if content is None:
+            _git(repo, "rm", "-q", path)
+            continue
+        (repo / path).parent.mkdir(parents=True, exist_ok=True)
+        (repo / path).write_text(content)
+        _git(repo, "add", path)
+    (repo / ".msg").write_text(message)
+    _git(repo, "commit", "-q", "--allow-empty", "--allow-empty-message", "--cleanup=verbatim", "-F", ".msg")
+
+
+@pytest.fixture
+def repo(tmp_path):
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "config", "user.name", "gfk")
+    _git(tmp_path, "config", "user.email", "gfk@example.com")
+    return tmp_path
+
+
+def _shas(index: CommitIndex, path: str):
+    return [index.table.sha(each) for each in index.get(path)]
+
+
+def test_separators_in_message(repo):
+    _commit(repo, "init", {"a.py": "1", "b.py": "1"})
+    _commit(repo, "weird \x1e record \x1f field \x1e\x1f", {"a.py": "2"})
+    _commit(repo, "", {"b.py": "2"})
+    _commit(repo, "last", {"a.py": "3"})
+
+    index = CommitIndex(git.Repo(repo))
+    index.build(file_paths=["a.py", "b.py"])
+    for path in ("a.py", "b.py"):
+        expected = [each.hexsha for each in git.Repo(repo).iter_commits(paths=path)]
+        assert _shas(index, path) == expected
+    messages = [index.table.message(each) for each in index.get("a.py")]
+    assert "weird \x1e record \x1f field \x1e\x1f" in messages[1]
+
+
+def _content(name: str, version: int) -> str:
+    # similar enough across versions to be detected as a rename
+    return "".join(f"{name} line {i}\n" for i in range(20)) + f"version {version}\n"
+
+
+@pytest.fixture
+def history_repo(repo):
+    _commit(repo, "init", {"a.py": _content("a", 0), "b.py": _content("b", 0), "lib/c.py": _content("c", 0)})
+    _commit(repo, "change a", {"a.py": _content("a", 1)})
+    # rename chain, then moved into a dir
+    _git(repo, "mv", "a.py", "a2.py")
+    _commit(repo, "rename a", {})
+    _commit(repo, "change a2", {"a2.py": _content("a", 2)})
+    (repo / "pkg").mkdir(exist_ok=True)
+    _git(repo, "mv", "a2.py", "pkg/a3.py")
+    _commit(repo, "move a into pkg", {})
+
+    # a side branch merged cleanly, and another one with a conflict resolved by hand
+    _git(repo, "checkout", "-q", "-b", "side")
+    _commit(repo, "side c", {"lib/c.py": _content("c", 1)})
+    _commit(repo, "side b", {"b.py": _content("b", "side")})
+    _git(repo, "checkout", "-q", "-")
+    _commit(repo, "main b", {"b.py": _content("b", "main")})
+    subprocess.call(["git", "merge", "-q", "side", "-m", "merge side"], cwd=repo,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _commit(repo, "merge side", {"b.py": _content("b", "merged")})
+    _git(repo, "checkout", "-q", "-b", "side2")
+    _commit(repo, "side2 c", {"lib/c.py": _content("c", 2)})
+    _git(repo, "checkout", "-q", "-")
+    _commit(repo, "main pkg", {"pkg/a3.py": _content("a", 3)})
+    _git(repo, "merge", "-q", "side2", "-m", "merge side2")
+
+    _git(repo, "mv", "lib/c.py", "pkg/c.py")
+    _commit(repo, "move c into pkg", {})
+    _commit(repo, "change c", {"pkg/c.py": _content("c", 3)})
+    return repo
+
+
+@pytest.fixture(params=["pathspec", "full walk"])
+def walk_mode(request, monkeypatch):
+    if request.param == "full walk":
+        monkeypatch.setattr("git_file_keyword.history._PATHSPEC_LIMIT", 0)
+    return request.param
+
+
+def _files(repo: pathlib.Path):
+    return git.Repo(repo).git.ls_files().split("\n")
+
+
+@pytest.mark.parametrize("max_count", [-1, 2])
+def test_same_as_iter_commits(history_repo, walk_mode, max_count):
+    repo = git.Repo(history_repo)
+    files = _files(history_repo)
+    dirs = ["pkg", "lib", ""]
+
+    index = CommitIndex(repo, max_count)
+    index.build(file_paths=files)
+    for path in files:
+        expected = [each.hexsha for each in repo.iter_commits(paths=path, max_count=max_count)]
+        assert _shas(index, path) == expected, path
+
+    index = CommitIndex(repo, max_count)
+    index.build(dir_paths=dirs)
+    for path in dirs:
+        expected = [each.hexsha for each in repo.iter_commits(paths=path or None, max_count=max_count)]
+        assert _shas(index, path) == expected, path
+
+
+@pytest.mark.parametrize("max_count", [-1, 2])
+def test_same_as_follow(history_repo, max_count):
+    repo = git.Repo(history_repo)
+    files = _files(history_repo)
+
+    index = CommitIndex(repo, max_count, renames=dict())
+    index.build(file_paths=files)
+    assert index.new_renames
+    for path in files:
+        args = ["--follow", "-M", "--format=%H"]
+        if max_count != -1:
+            args.append(f"-n{max_count}")
+        assert _shas(index, path) == repo.git.log(*args, "--", path).split(), path
+
+    # renames known from the cache, no detection at all
+    again = CommitIndex(repo, max_count, renames=dict(index.renames))
+    again.build(file_paths=files)
+    assert not again.new_renames
+    for path in files:
+        assert _shas(again, path) == _shas(index, path)
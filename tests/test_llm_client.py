@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from git_file_keyword.llm_client import AsyncChatClient, TokenBucket
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # set by `stub`
+    state: dict = None
+    lock: threading.Lock = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.state["requests"] += 1
+            self.state["inflight"] += 1
+            self.state["max_inflight"] = max(self.state["max_inflight"], self.state["inflight"])
+            throttle = self.state["throttle"] > 0
+            if throttle:
+                self.state["throttle"] -= 1
+            garbage = self.state["garbage"] > 0
+            if garbage:
+                self.state["garbage"] -= 1
+        try:
+            if garbage or "fail" in body["messages"][-1]["content"]:
+                # e.g. an html page from a proxy
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b"<html>bad gateway</html>")
+                return
+            if throttle:
+                self.send_response(429)
+                self.send_header("Retry-After", "0.3")
+                self.end_headers()
+                self.wfile.write(b"slow down")
+                self.state["throttled_at"] = time.monotonic()
+                return
+
+            time.sleep(self.state["delay"])
+            content = "echo: " + body["messages"][-1]["content"]
+            data = json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            self.state.setdefault("answered_at", []).append(time.monotonic())
+        finally:
+            with self.lock:
+                self.state["inflight"] -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    state = {"requests": 0, "inflight": 0, "max_inflight": 0, "throttle": 0, "garbage": 0, "delay": 0.0}
+    handler = type("Handler", (_StubHandler,), {"state": state, "lock": threading.Lock()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1", state
+    server.shutdown()
+    server.server_close()
+
+
+def _messages(i: int):
+    return [{"role": "user", "content": f"ask {i}"}]
+
+
+def test_retry_after_429(stub):
+    api_base, state = stub
+    state["throttle"] = 1
+    client = AsyncChatClient(api_base, "stub", concurrency=1, max_retries=2)
+
+    assert client.chat_many([_messages(0)]) == ["echo: ask 0"]
+    assert state["requests"] == 2
+    # waited as the server asked, not the default backoff (1s+)
+    waited = state["answered_at"][0] - state["throttled_at"]
+    assert 0.3 <= waited < 1.0
+
+
+def test_concurrency_cap(stub):
+    api_base, state = stub
+    state["delay"] = 0.2
+    client = AsyncChatClient(api_base, "stub", concurrency=3)
+
+    responses = client.chat_many([_messages(i) for i in range(9)])
+    assert responses == [f"echo: ask {i}" for i in range(9)]
+    assert state["max_inflight"] == 3
+
+
+def test_broken_body_retried(stub):
+    api_base, state = stub
+    state["garbage"] = 1
+    client = AsyncChatClient(api_base, "stub", concurrency=1, max_retries=1)
+
+    assert client.chat_many([_messages(0)]) == ["echo: ask 0"]
+    assert state["requests"] == 2
+
+
+def test_failure_keeps_other_answers(stub):
+    api_base, state = stub
+    client = AsyncChatClient(api_base, "stub", concurrency=2, max_retries=0)
+    requests = [_messages(0), [{"role": "user", "content": "fail"}], _messages(2)]
+
+    arrived = dict()
+    responses = client.chat_many(requests, on_response=arrived.__setitem__)
+    assert responses == ["echo: ask 0", None, "echo: ask 2"]
+    assert arrived == {0: "echo: ask 0", 2: "echo: ask 2"}
+
+
+def test_token_bucket_paced_from_start():
+    async def _acquire_all(bucket: TokenBucket, times: int) -> float:
+        start = time.monotonic()
+        for _ in range(times):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 240 rpm: a burst of one second (4) at most, then one request per 0.25s
+    # a bucket starting with a whole minute would take no time
+    assert asyncio.run(_acquire_all(TokenBucket(240), 8)) >= 0.95
+    # unlimited
+    assert asyncio.run(_acquire_all(TokenBucket(0), 100)) < 0.1
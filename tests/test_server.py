@@ -0,0 +1,47 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from git_file_keyword.result import Result
+from git_file_keyword.server import create_server
+
+
+class _StubService(object):
+    result = Result()
+
+    def keywords(self, paths):
+        return {each: None for each in paths}
+
+    def query(self, words, limit=20):
+        return [{"path": each, "limit": limit} for each in words]
+
+
+@pytest.fixture
+def base_url():
+    server = create_server(_StubService(), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def _request(url: str, data: bytes = None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_bad_requests(base_url):
+    assert _request(f"{base_url}/query?word=a&limit=2") == (200, [{"path": "a", "limit": 2}])
+    assert _request(f"{base_url}/query?word=a&limit=abc")[0] == 400
+
+    assert _request(f"{base_url}/keywords", b'{"paths": ["a.py"]}') == (200, {"a.py": None})
+    assert _request(f"{base_url}/keywords", b"{broken")[0] == 400
+    assert _request(f"{base_url}/keywords", b'{"paths": "a.py"}')[0] == 400
+
+    assert _request(f"{base_url}/refresh")[0] == 405
@@ -0,0 +1,94 @@
+import pathlib
+import typing
+
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from git_file_keyword.config import ExtractConfig
+from git_file_keyword.plugin import TfidfPlugin, TFIDF_PLUGIN_ID
+from git_file_keyword.result import FileResult, Result
+
+CORPUS = {
+    "a.py": {"stream": 3, "parser": 1},
+    "b.py": {"stream": 1, "cache": 2, "token": 1},
+    "c/z.py": {"socket": 2, "cache": 1},
+    "c/w.py": {"render": 1, "token": 4},
+}
+
+
+def _result(corpus: typing.Dict[str, typing.Dict[str, int]], last: Result = None) -> Result:
+    # like the next run reading the cache of `last`
+    result = Result()
+    for path, word_freq in corpus.items():
+        cached = last.file_results.get(pathlib.Path(path)) if last else None
+        if cached is not None and cached.word_freq == word_freq:
+            file_result = cached.model_copy(deep=True)
+            file_result.cached = True
+        else:
+            file_result = FileResult(path=path, word_freq=word_freq)
+        result.file_results[pathlib.Path(path)] = file_result
+    if last:
+        result.plugin_state = dict(last.plugin_state)
+    return result
+
+
+def _assert_same_as_sklearn(result: Result):
+    paths = list(result.file_results)
+    docs = [
+        [word for word, freq in result.file_results[each].word_freq.items() for _ in range(freq)]
+        for each in paths
+    ]
+    vectorizer = TfidfVectorizer(analyzer=lambda doc: doc)
+    matrix = vectorizer.fit_transform(docs)
+    feature_names = vectorizer.get_feature_names_out()
+    for row, each in zip(matrix, paths):
+        expected = {feature_names[i]: score for i, score in zip(row.indices, row.data)}
+        actual = result.file_results[each].plugin_output[TFIDF_PLUGIN_ID]
+        assert actual == pytest.approx(expected)
+
+
+def test_tfidf_incremental():
+    config = ExtractConfig()
+    plugin = TfidfPlugin()
+
+    result = _result(CORPUS)
+    plugin.apply(config, result)
+    _assert_same_as_sklearn(result)
+
+    # one file changed, df of its words changed
+    corpus = dict(CORPUS, **{"c/z.py": {"socket": 2, "stream": 1}})
+    result = _result(corpus, result)
+    plugin.apply(config, result)
+    assert result.metrics.counters["tfidf_rescored"] < len(corpus)
+    _assert_same_as_sklearn(result)
+
+    # nothing changed
+    last = result
+    result = _result(corpus, last)
+    plugin.apply(config, result)
+    assert result.metrics.counters["tfidf_rescored"] == 0
+    _assert_same_as_sklearn(result)
+
+
+def test_tfidf_stale_state():
+    config = ExtractConfig()
+    plugin = TfidfPlugin()
+    result = _result(CORPUS)
+    plugin.apply(config, result)
+    state = result.plugin_state
+
+    # changed by a run without the plugin, the kept state is stale
+    corpus = dict(CORPUS, **{"c/z.py": {"stream": 1, "widget": 2}})
+    unscored = _result(corpus, result)
+
+    # cached, but never scored
+    result = _result(corpus, unscored)
+    plugin.apply(config, result)
+    _assert_same_as_sklearn(result)
+
+    # changed again
+    corpus = dict(corpus, **{"c/z.py": {"lexer": 1}})
+    result = _result(corpus, unscored)
+    result.plugin_state = state
+    plugin.apply(config, result)
+    _assert_same_as_sklearn(result)
@@ -0,0 +1,69 @@
+import glob
+import os
+import warnings
+
+import pytest
+
+from git_file_keyword.utils import glob_to_regex
+
+FILES = [
+    "top.py",
+    "readme.md",
+    ".hidden.py",
+    "[x].py",
+    "^.py",
+    "src/a.py",
+    "src/b.py",
+    "src/c.txt",
+    "src/&.py",
+    "src/.env",
+    "src/deep/d.py",
+    "src/deep/more/e.txt",
+    "src/.cache/f.py",
+    "docs/a.py",
+]
+
+PATTERNS = [
+    "**",
+    "*",
+    "*.py",
+    "**/*.py",
+    "src/**",
+    "./src/**",
+    "./src/*.py",
+    "src/*",
+    "src/**/*.txt",
+    "**/.*",
+    "src/.*/*.py",
+    "*/*/*.py",
+    "src/?.py",
+    "src/[ab].py",
+    "src/[!a].py",
+    "src/[&a].py",
+    "[[]x].py",
+    "[^].py",
+    "**/deep/**",
+]
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    for each in FILES:
+        path = tmp_path / each
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_glob_to_regex_like_glob(tree, pattern):
+    expected = {
+        os.path.normpath(each).replace(os.sep, "/")
+        for each in glob.glob(pattern, recursive=True)
+        if os.path.isfile(each)
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        regex = glob_to_regex(pattern)
+    assert {each for each in FILES if regex.match(each)} == expected